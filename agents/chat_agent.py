@@ -4,17 +4,27 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import json
 import logging
 import asyncio
-from google.cloud import speech, vision
 from langgraph.graph import Graph
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, List, Optional
 from pydantic import BaseModel
-from openai import OpenAI
-from pinecone import Pinecone as PineconeClient
-import cv2
-import numpy as np
 from dotenv import load_dotenv
 import getpass
+import threading
 import time
+import uuid
+from contextlib import contextmanager
+from core.embedding_cache import EmbeddingCache
+from core.vector_store import EMBEDDING_DIMENSION, EMBEDDING_MODEL, open_index
+from core.semantic_cache import SemanticCache, SharedSemanticCache
+from core.metrics import registry, SIZE_BUCKETS
+from core.frame_annotation import StubAnnotator, VisionAnnotator, annotate_frames
+from core.executors import run_blocking, run_cpu
+from core.speech_stream import VoiceStream
+from core.audio import TARGET_SAMPLE_RATE, prepare_speech_audio
+from core.media_cache import MediaCache, media_key
+from core.issue_rules import FALLBACK_SOLUTIONS, matcher_from_env
+from core.issue_classifier import IssueClassifier
+from core.lexical_index import LexicalIndex, reciprocal_rank_fusion
 
 # Load environment variables
 load_dotenv(dotenv_path='/home/vincent/ixome/.env', override=True)
@@ -23,41 +33,233 @@ load_dotenv(dotenv_path='/home/vincent/ixome/.env', override=True)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Verify and set API keys
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    logger.error("OPENAI_API_KEY not found in .env file!")
-    openai_api_key = getpass.getpass("Please enter OPENAI_API_KEY: ")
-    os.environ["OPENAI_API_KEY"] = openai_api_key
-
-pinecone_api_key = os.getenv("PINECONE_API_KEY")
-if not pinecone_api_key:
-    logger.error("PINECONE_API_KEY not found in .env file!")
-    pinecone_api_key = getpass.getpass("Please enter PINECONE_API_KEY: ")
-    os.environ["PINECONE_API_KEY"] = pinecone_api_key
-
-google_credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-if not google_credentials_path:
-    logger.error("GOOGLE_APPLICATION_CREDENTIALS not found in .env file!")
-    google_credentials_path = getpass.getpass("Please enter GOOGLE_APPLICATION_CREDENTIALS path: ")
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = google_credentials_path
-
-# Initialize clients
-client = OpenAI(api_key=openai_api_key)
-pc = PineconeClient(api_key=pinecone_api_key)
-speech_client = speech.SpeechClient()
-vision_client = vision.ImageAnnotatorClient()
-
-# Initialize Pinecone index
+# Clients are created lazily on first use and shared by every ChatAgent in the
+# process, so importing this module performs no network calls or prompts.
 index_name = "troubleshooter-index"
-if index_name not in pc.list_indexes().names():
-    pc.create_index(
-        name=index_name,
-        dimension=3072,  # Dimension for text-embedding-3-large
-        metric='cosine',
-        spec={'serverless': {'cloud': 'aws', 'region': os.getenv("PINECONE_ENVIRONMENT", "us-east-1")}}
-    )
-index = pc.Index(index_name)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', index_name))
+FAST_START = os.getenv("CHAT_AGENT_FAST_START", "0") == "1"
+# BM25 index over the same passages, written by load_to_pinecone.py and fused with vector results
+LEXICAL_INDEX_PATH = os.getenv(
+    "LEXICAL_INDEX_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', f"{index_name}.lexical.db")
+)
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+_clients: Dict[str, Any] = {}
+_client_locks = {name: threading.Lock() for name in ("openai", "pinecone", "index", "speech", "vision")}
+# Read-only state (local index, lexical index, issue classifier) loaded once per process and shared by
+# every ChatAgent; a pre-fork server loads it in the master so all workers share the same pages
+_shared: Dict[str, Any] = {}
+_shared_lock = threading.Lock()
+
+def require_env(name: str, prompt: str) -> str:
+    """Return an environment variable, prompting for it only in an interactive session."""
+    value = os.getenv(name)
+    if not value:
+        logger.error(f"{name} not found in .env file!")
+        if not (sys.stdin and sys.stdin.isatty()):
+            raise RuntimeError(f"{name} is not set")
+        value = getpass.getpass(prompt)
+        os.environ[name] = value
+    return value
+
+def _shared_client(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _client_locks[name]:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+                logger.info(f"Initialized {name} client")
+    return client
+
+def get_openai_client():
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=require_env("OPENAI_API_KEY", "Please enter OPENAI_API_KEY: "))
+    return _shared_client("openai", create)
+
+def get_pinecone_client():
+    def create():
+        from pinecone import Pinecone as PineconeClient
+        return PineconeClient(api_key=require_env("PINECONE_API_KEY", "Please enter PINECONE_API_KEY: "))
+    return _shared_client("pinecone", create)
+
+def get_index():
+    """Return the vector index (VECTOR_BACKEND=local serves queries from an in-process index)."""
+    return _shared_client("index", lambda: open_index(
+        VECTOR_BACKEND,
+        index_name,
+        dimension=EMBEDDING_DIMENSION,
+        pinecone_client=get_pinecone_client() if VECTOR_BACKEND == "pinecone" else None,
+        local_path=LOCAL_INDEX_PATH,
+        region=os.getenv("PINECONE_ENVIRONMENT", "us-east-1")
+    ))
+
+def get_speech_client():
+    def create():
+        from google.cloud import speech
+        require_env("GOOGLE_APPLICATION_CREDENTIALS", "Please enter GOOGLE_APPLICATION_CREDENTIALS path: ")
+        return speech.SpeechClient()
+    return _shared_client("speech", create)
+
+def get_vision_client():
+    def create():
+        from google.cloud import vision
+        require_env("GOOGLE_APPLICATION_CREDENTIALS", "Please enter GOOGLE_APPLICATION_CREDENTIALS path: ")
+        return vision.ImageAnnotatorClient()
+    return _shared_client("vision", create)
+
+def _reset_clients_after_fork():
+    # Network clients (OpenAI and Pinecone HTTP pools, Google gRPC channels) cannot be shared with the
+    # parent process; the memory-mapped local index can, and stays
+    global _client_locks, _shared_lock
+    for name in list(_clients):
+        if not (name == "index" and VECTOR_BACKEND == "local"):
+            del _clients[name]
+    _client_locks = {name: threading.Lock() for name in _client_locks}
+    _shared_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+def warm_up(strict: bool = False):
+    """Create every client and run the remote index checks.
+
+    Failures are logged; with strict=True the first one is re-raised.
+    """
+    started = time.perf_counter()
+    for name, getter in (("openai", get_openai_client), ("index", get_index),
+                         ("speech", get_speech_client), ("vision", get_vision_client)):
+        try:
+            getter()
+        except Exception as e:
+            logger.error(f"Warm-up of {name} client failed: {e}")
+            if strict:
+                raise
+    logger.info(f"ChatAgent warm-up finished in {time.perf_counter() - started:.2f}s")
+
+# Query embedding cache (in-process LRU, optional SQLite tier on disk)
+query_embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    disk_path=os.getenv("EMBEDDING_CACHE_PATH"),
+    max_disk_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+)
+
+# Processed text of voice/video uploads, keyed by content hash, so re-sent media skips Speech/Vision
+media_result_cache = MediaCache(
+    max_bytes=int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    disk_path=os.getenv("MEDIA_CACHE_PATH"),
+    max_disk_bytes=int(os.getenv("MEDIA_CACHE_MAX_DISK_BYTES", str(64 * 1024 * 1024)))
+)
+# Results that may be transient and must be recomputed on a resend
+MEDIA_UNCACHEABLE = {"Error processing voice", "Error processing video", "No labels detected"}
+
+# Semantic response cache consulted before solution retrieval
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+# With a path (ideally on tmpfs, e.g. /dev/shm/ixome-response-cache) the cache is one mmap'd file
+# shared by every worker process instead of a copy per process
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+
+# Video keyframe selection (see core.video_frames.sample_frames)
+VIDEO_FRAME_STRATEGY = os.getenv("VIDEO_FRAME_STRATEGY", "scene")
+VIDEO_FRAME_STRIDE = int(os.getenv("VIDEO_FRAME_STRIDE", "15"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "3"))
+VIDEO_SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.3"))
+
+# Frame labeling (VISION_ANNOTATOR=stub labels frames offline for tests and benchmarks)
+VISION_ANNOTATOR = os.getenv("VISION_ANNOTATOR", "vision")
+VISION_BATCH_SIZE = int(os.getenv("VISION_BATCH_SIZE", "8"))
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "2"))
+
+# Issue rules (JSON list of {"issue", "priority", "phrases"}); defaults to core.issue_rules.ISSUE_RULES
+ISSUE_RULES_PATH = os.getenv("ISSUE_RULES_PATH")
+# Nearest-centroid classifier over query embeddings; build with `python -m core.issue_classifier`
+ISSUE_CLASSIFIER_PATH = os.getenv(
+    "ISSUE_CLASSIFIER_PATH", os.path.join(os.path.dirname(__file__), '..', 'data', 'issue_centroids.npz')
+)
+ISSUE_CLASSIFIER_MIN_SCORE = float(os.getenv("ISSUE_CLASSIFIER_MIN_SCORE", "0.35"))
+
+# Voice uploads are decoded, downmixed, resampled and silence-trimmed before recognition
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") != "0"
+AUDIO_TRIM_SILENCE = os.getenv("AUDIO_TRIM_SILENCE", "1") != "0"
+
+# Latency histograms, exported in Prometheus text format by core.metrics.registry
+REQUEST_SECONDS = registry.histogram(
+    "chat_agent_request_seconds", "End-to-end ChatAgent request wall time.", ["input_type"]
+)
+NODE_SECONDS = registry.histogram(
+    "chat_agent_node_seconds", "Wall time spent in each ChatAgent graph node.", ["node"]
+)
+NODE_EXTERNAL_SECONDS = registry.histogram(
+    "chat_agent_node_external_seconds", "Time each graph node spent waiting on external services.", ["node"]
+)
+EXTERNAL_CALL_SECONDS = registry.histogram(
+    "chat_agent_external_call_seconds", "Latency of individual external calls.", ["call"]
+)
+PAYLOAD_BYTES = registry.histogram(
+    "chat_agent_payload_bytes", "Size of request inputs and external call payloads.", ["stage"], SIZE_BUCKETS
+)
+AUDIO_BYTES_SAVED = registry.histogram(
+    "chat_agent_audio_bytes_saved", "Bytes removed from voice uploads by audio preprocessing.", [], SIZE_BUCKETS
+)
+AUDIO_SECONDS_SAVED = registry.histogram(
+    "chat_agent_audio_seconds_saved", "Seconds of audio removed from voice uploads by silence trimming."
+)
+
+def new_response_cache():
+    if RESPONSE_CACHE_PATH:
+        return SharedSemanticCache(
+            RESPONSE_CACHE_PATH, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL,
+            max_entries=RESPONSE_CACHE_SIZE
+        )
+    return SemanticCache(threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_SIZE)
+
+def load_issue_classifier() -> Optional[IssueClassifier]:
+    if not os.path.exists(ISSUE_CLASSIFIER_PATH):
+        logger.info(f"No issue classifier at {ISSUE_CLASSIFIER_PATH}; using keyword rules only")
+        return None
+    try:
+        classifier = IssueClassifier.load(ISSUE_CLASSIFIER_PATH, min_score=ISSUE_CLASSIFIER_MIN_SCORE)
+    except Exception as e:
+        logger.error(f"Failed to load issue classifier from {ISSUE_CLASSIFIER_PATH}: {e}")
+        return None
+    if classifier.model and classifier.model != EMBEDDING_MODEL:
+        logger.error(f"Issue classifier was built with {classifier.model}, queries use {EMBEDDING_MODEL}")
+        return None
+    logger.info(f"Loaded issue classifier with labels {classifier.labels}")
+    return classifier
+
+def load_lexical_index() -> Optional[LexicalIndex]:
+    if not os.path.exists(LEXICAL_INDEX_PATH):
+        logger.info(f"No lexical index at {LEXICAL_INDEX_PATH}; retrieval is vector-only")
+        return None
+    logger.info(f"Using lexical index {LEXICAL_INDEX_PATH}")
+    return LexicalIndex(LEXICAL_INDEX_PATH)
+
+def shared_state(name: str, loader: Callable[[], Any]) -> Any:
+    """Return read-only state loaded once per process (None results included)."""
+    with _shared_lock:
+        if name not in _shared:
+            _shared[name] = loader()
+        return _shared[name]
+
+def preload_shared_state():
+    """Load the read-only indexes up front, e.g. in a pre-fork master before its workers start.
+
+    Workers inherit them copy-on-write, and the local vector index is a
+    read-only memory map, so N workers keep one copy of this data instead of N.
+    """
+    started = time.perf_counter()
+    shared_state("issue_classifier", load_issue_classifier)
+    shared_state("lexical_index", load_lexical_index)
+    if VECTOR_BACKEND == "local":
+        get_index()
+    logger.info(f"Preloaded shared ChatAgent state in {time.perf_counter() - started:.2f}s")
 
 # Define Pydantic models
 class ClientQuery(BaseModel):
@@ -76,26 +278,45 @@ class AgentState(BaseModel):
     query: Optional[ClientQuery] = None
     processed_input: Optional[str] = None
     issue: Optional[str] = None
+    embedding: Optional[List[float]] = None
     solution: Optional[Solution] = None
     result: Dict = {}
+    trace_id: Optional[str] = None
+    external_seconds: float = 0.0
+    timings: Dict[str, Dict[str, float]] = {}
 
 class ChatAgent:
-    def __init__(self):
+    def __init__(self, embedding_cache: Optional[EmbeddingCache] = None,
+                 response_cache: Optional[SemanticCache] = None, frame_annotator=None,
+                 fast_start: bool = FAST_START, media_cache: Optional[MediaCache] = None,
+                 issue_classifier: Optional[IssueClassifier] = None,
+                 lexical_index: Optional[LexicalIndex] = None):
         self.logger = logger
-        self.client = client
-        self.speech_client = speech_client
-        self.vision_client = vision_client
-        self.index = index
+        if frame_annotator is None and VISION_ANNOTATOR == "stub":
+            frame_annotator = StubAnnotator()
+        self._frame_annotator = frame_annotator
+        self.embedding_cache = embedding_cache or query_embedding_cache
+        self.response_cache = response_cache or new_response_cache()
+        self.media_cache = media_cache or media_result_cache
+        self.issue_matcher = matcher_from_env(ISSUE_RULES_PATH)
+        self.issue_classifier = issue_classifier or shared_state("issue_classifier", load_issue_classifier)
+        self.lexical_index = lexical_index if lexical_index is not None else \
+            shared_state("lexical_index", load_lexical_index)
 
-        # Set up LangGraph workflow
+        # Set up LangGraph workflow; every node is wrapped with latency instrumentation
         self.graph = Graph()
-        self.graph.add_node("input", self.input_node)
-        self.graph.add_node("text_processing", self.text_processing_node)
-        self.graph.add_node("voice_processing", self.voice_processing_node)
-        self.graph.add_node("video_processing", self.video_processing_node)
-        self.graph.add_node("issue_identification", self.issue_identification_node)
-        self.graph.add_node("solution_retrieval", self.solution_retrieval_node)
-        self.graph.add_node("response_generation", self.response_generation_node)
+        nodes = {
+            "input": self.input_node,
+            "text_processing": self.text_processing_node,
+            "voice_processing": self._media_cached(self.voice_processing_node),
+            "video_processing": self._media_cached(self.video_processing_node),
+            "issue_identification": self.issue_identification_node,
+            "response_cache": self.response_cache_node,
+            "solution_retrieval": self.solution_retrieval_node,
+            "response_generation": self.response_generation_node,
+        }
+        for name, node in nodes.items():
+            self.graph.add_node(name, self._timed(name, node))
 
         self.graph.add_conditional_edges(
             "input",
@@ -105,12 +326,99 @@ class ChatAgent:
         self.graph.add_edge("text_processing", "issue_identification")
         self.graph.add_edge("voice_processing", "issue_identification")
         self.graph.add_edge("video_processing", "issue_identification")
-        self.graph.add_edge("issue_identification", "solution_retrieval")
+        self.graph.add_edge("issue_identification", "response_cache")
+        self.graph.add_conditional_edges(
+            "response_cache",
+            lambda state: "hit" if state.solution else "miss",
+            {"hit": "response_generation", "miss": "solution_retrieval"}
+        )
         self.graph.add_edge("solution_retrieval", "response_generation")
         self.graph.set_entry_point("input")
         self.graph.set_finish_point("response_generation")
         self.app = self.graph.compile()
 
+        if fast_start:
+            # Serve immediately; clients are created in the background or on first use
+            threading.Thread(target=warm_up, name="chat-agent-warm-up", daemon=True).start()
+        else:
+            warm_up(strict=True)
+
+    @property
+    def client(self):
+        return get_openai_client()
+
+    @property
+    def index(self):
+        return get_index()
+
+    @property
+    def speech_client(self):
+        return get_speech_client()
+
+    @property
+    def vision_client(self):
+        return get_vision_client()
+
+    @property
+    def frame_annotator(self):
+        return self._frame_annotator or VisionAnnotator(self.vision_client)
+
+    def _timed(self, name: str, node):
+        """Wrap a graph node to record its wall time and external-call time."""
+        async def timed_node(state: AgentState) -> AgentState:
+            started = time.perf_counter()
+            external_before = state.external_seconds
+            try:
+                return await node(state)
+            finally:
+                wall = time.perf_counter() - started
+                external = state.external_seconds - external_before
+                NODE_SECONDS.observe(wall, node=name)
+                NODE_EXTERNAL_SECONDS.observe(external, node=name)
+                state.timings[name] = {"wall_seconds": round(wall, 6), "external_seconds": round(external, 6)}
+        return timed_node
+
+    def media_config(self, input_type: str) -> Dict[str, Any]:
+        """Settings that change how an upload of this type is turned into text; part of the cache key."""
+        if input_type == "voice":
+            return {"preprocess": AUDIO_PREPROCESS, "trim": AUDIO_TRIM_SILENCE,
+                    "sample_rate": TARGET_SAMPLE_RATE, "language": "en-US"}
+        return {"strategy": VIDEO_FRAME_STRATEGY, "stride": VIDEO_FRAME_STRIDE, "max_frames": VIDEO_MAX_FRAMES,
+                "scene_threshold": VIDEO_SCENE_THRESHOLD, "annotator": type(self._frame_annotator).__name__ if self._frame_annotator else "VisionAnnotator"}
+
+    def _media_cached(self, node):
+        """Wrap a media processing node so identical uploads reuse the earlier processed_input."""
+        async def cached_node(state: AgentState) -> AgentState:
+            data = state.input_data
+            if state.processed_input or not isinstance(data, (bytes, bytearray)) or not data:
+                return await node(state)
+            key = await run_blocking("media_hash", media_key, state.input_type, data,
+                                     self.media_config(state.input_type))
+            cached = await run_blocking("cache", self.media_cache.get, key)
+            if cached is not None:
+                state.processed_input = cached
+                self.logger.info(f"Media cache hit for {state.input_type} input: {cached}")
+                return state
+            state = await node(state)
+            if state.processed_input and state.processed_input not in MEDIA_UNCACHEABLE:
+                await run_blocking("cache", self.media_cache.put, key, state.processed_input, state.input_type)
+            return state
+        return cached_node
+
+    @contextmanager
+    def external_call(self, state: Optional[AgentState], call: str, payload_bytes: int = 0):
+        """Time a call to an external service and charge it to the current node."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            EXTERNAL_CALL_SECONDS.observe(elapsed, call=call)
+            if payload_bytes:
+                PAYLOAD_BYTES.observe(payload_bytes, stage=call)
+            if state is not None:
+                state.external_seconds += elapsed
+
     async def input_node(self, state: AgentState) -> AgentState:
         self.logger.info(f"Received input: type={state.input_type}, data=<data>")
         return state
@@ -125,15 +433,40 @@ class ChatAgent:
         return state
 
     async def voice_processing_node(self, state: AgentState) -> AgentState:
+        if state.processed_input:
+            self.logger.info(f"Using streamed voice transcript: {state.processed_input}")
+            return state
         audio_data = state.input_data or b""
         if audio_data:
             try:
+                from google.cloud import speech
+                sample_rate = None
+                if AUDIO_PREPROCESS:
+                    try:
+                        audio_data, report = await run_cpu(
+                            prepare_speech_audio, audio_data, TARGET_SAMPLE_RATE, AUDIO_TRIM_SILENCE
+                        )
+                        sample_rate = report["sample_rate"]
+                        AUDIO_BYTES_SAVED.observe(report["bytes_saved"])
+                        AUDIO_SECONDS_SAVED.observe(report["seconds_saved"])
+                        self.logger.info(f"Audio preprocessing saved {report['bytes_saved']} bytes "
+                                         f"and {report['seconds_saved']}s: {report}")
+                    except ValueError as e:
+                        self.logger.warning(f"Sending voice input unprocessed: {e}")
+                if not audio_data:
+                    state.processed_input = "No speech detected"
+                    self.logger.info("Only silence in audio; skipping recognition")
+                    return state
                 audio = speech.RecognitionAudio(content=audio_data)
                 config = speech.RecognitionConfig(
                     encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                    language_code='en-US'
+                    language_code='en-US',
+                    **({"sample_rate_hertz": sample_rate} if sample_rate else {})
                 )
-                response = self.speech_client.recognize(config=config, audio=audio)
+                with self.external_call(state, "speech_recognize", len(audio_data)):
+                    response = await run_blocking(
+                        "speech", lambda: self.speech_client.recognize(config=config, audio=audio)
+                    )
                 if response.results:
                     state.processed_input = response.results[0].alternatives[0].transcript
                     self.logger.info(f"Processed voice input: {state.processed_input}")
@@ -152,23 +485,20 @@ class ChatAgent:
         video_data = state.input_data or b""
         if video_data:
             try:
-                temp_file = "temp_video.mp4"
-                with open(temp_file, "wb") as f:
-                    f.write(video_data)
-                cap = cv2.VideoCapture(temp_file)
-                frame_descriptions = []
-                while cap.isOpened():
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    _, buffer = cv2.imencode('.jpg', frame)
-                    image = vision.Image(content=buffer.tobytes())
-                    response = self.vision_client.label_detection(image=image)
-                    labels = [label.description for label in response.label_annotations]
-                    frame_descriptions.append(", ".join(labels))
-                cap.release()
-                os.remove(temp_file)
-                state.processed_input = "; ".join(frame_descriptions[:3]) if frame_descriptions else "No labels detected"
+                from core.video_frames import extract_keyframes
+                frames = await run_cpu(
+                    extract_keyframes, video_data,
+                    VIDEO_FRAME_STRATEGY, VIDEO_FRAME_STRIDE, VIDEO_MAX_FRAMES, VIDEO_SCENE_THRESHOLD
+                )
+                with self.external_call(state, "vision_batch_annotate", sum(len(image) for _, image in frames)):
+                    labeled = await run_blocking(
+                        "vision", lambda: annotate_frames(
+                            frames, self.frame_annotator, VISION_BATCH_SIZE, VISION_CONCURRENCY
+                        )
+                    )
+                self.logger.info(f"Frame labels by timestamp (ms): {[(round(ts), labels) for ts, labels in labeled]}")
+                frame_descriptions = [", ".join(labels) for _, labels in labeled if labels]
+                state.processed_input = "; ".join(frame_descriptions) if frame_descriptions else "No labels detected"
                 self.logger.info(f"Processed video input: {state.processed_input}")
             except Exception as e:
                 self.logger.error(f"Error processing video: {e}")
@@ -178,45 +508,100 @@ class ChatAgent:
             self.logger.warning("No video data provided for video processing")
         return state
 
+    def identify_issue(self, text: str) -> str:
+        return self.issue_matcher.best(text)
+
     async def issue_identification_node(self, state: AgentState) -> AgentState:
-        processed_input = state.processed_input.lower() if state.processed_input else ""
-        self.logger.info(f"Identifying issue from: {processed_input}")
-        if any(phrase in processed_input for phrase in ["no sound", "sound not working", "surround sound", "audio issue"]):
-            state.issue = "no_sound"
-        elif "tv not turning on" in processed_input:
-            state.issue = "tv_not_turning_on"
-        elif "settings" in processed_input:
-            state.issue = "settings_issue"
-        elif any(phrase in processed_input for phrase in ["flashing light", "error code", "blinking"]):
-            state.issue = "error_code"
-        else:
-            state.issue = "unknown"
+        self.logger.info(f"Identifying issue from: {state.processed_input}")
+        state.issue = self.identify_issue(state.processed_input)
+        if self.issue_classifier is not None:
+            # The query embedding is needed for retrieval anyway; computing it here makes classification free
+            try:
+                state.embedding = await self.embed_query(state.processed_input or "unknown issue", state)
+                issue, score = self.issue_classifier.classify(state.embedding)
+                self.logger.info(f"Issue classifier: {issue} (score {score:.3f}), keyword rules: {state.issue}")
+                if issue != "unknown":
+                    state.issue = issue
+            except Exception as e:
+                self.logger.error(f"Issue classification failed: {e}")
         self.logger.info(f"Identified issue: {state.issue}")
         return state
 
+    async def embed_query(self, text: str, state: Optional[AgentState] = None) -> List[float]:
+        """Return the embedding for text, skipping the OpenAI call on a cache hit."""
+        embedding = await run_blocking("cache", self.embedding_cache.get, text, EMBEDDING_MODEL)
+        if embedding is None:
+            with self.external_call(state, "embedding", len(text.encode("utf-8"))):
+                embedding = await run_blocking(
+                    "embedding",
+                    lambda: self.client.embeddings.create(model=EMBEDDING_MODEL, input=text).data[0].embedding
+                )
+            await run_blocking("cache", self.embedding_cache.put, text, EMBEDDING_MODEL, embedding)
+        return embedding
+
+    async def response_cache_node(self, state: AgentState) -> AgentState:
+        try:
+            state.embedding = state.embedding or await self.embed_query(state.processed_input or "unknown issue", state)
+        except Exception as e:
+            self.logger.error(f"Embedding failed: {e}")
+            return state
+        cached = await run_blocking("cache", self.response_cache.lookup, state.embedding)
+        if cached is not None:
+            state.solution = Solution(**cached)
+            self.logger.info(f"Semantic cache hit: {state.solution.solution}")
+        return state
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Return embedding and response cache metrics."""
+        return {"embedding_cache": self.embedding_cache.stats(), "response_cache": self.response_cache.stats(),
+                "media_cache": self.media_cache.stats()}
+
+    async def vector_matches(self, embedding: List[float], state: AgentState) -> List[Dict[str, Any]]:
+        top_k = RETRIEVAL_CANDIDATES if self.lexical_index is not None else 1
+        with self.external_call(state, "index_query"):
+            results = await run_blocking(
+                "index", lambda: self.index.query(vector=embedding, top_k=top_k, include_metadata=True)
+            )
+        return [{"id": m['id'], "score": m['score'], "metadata": m['metadata']} for m in results['matches']]
+
+    async def lexical_matches(self, text: str) -> List[Dict[str, Any]]:
+        if self.lexical_index is None or not text:
+            return []
+        return await run_blocking("index", self.lexical_index.search, text, RETRIEVAL_CANDIDATES)
+
     async def solution_retrieval_node(self, state: AgentState) -> AgentState:
         try:
-            embedding = self.client.embeddings.create(
-                model="text-embedding-3-large",
-                input=state.processed_input or "unknown issue"
-            ).data[0].embedding
-            results = self.index.query(vector=embedding, top_k=1, include_metadata=True)
-            if results['matches']:
-                solution_text = results['matches'][0]['metadata'].get('solution', "No solution found")
-                confidence = results['matches'][0]['score']
-                state.solution = Solution(solution=solution_text, confidence=confidence, source="Pinecone")
-                self.logger.info(f"Retrieved solution from Pinecone: {solution_text}")
+            embedding = state.embedding or await self.embed_query(state.processed_input or "unknown issue", state)
+            started = time.perf_counter()
+            vector, lexical = await asyncio.gather(
+                self.vector_matches(embedding, state), self.lexical_matches(state.processed_input),
+                return_exceptions=True
+            )
+            if isinstance(vector, Exception):
+                self.logger.error(f"Vector index query failed: {vector}")
+                vector = []
+            if isinstance(lexical, Exception):
+                self.logger.error(f"Lexical search failed: {lexical}")
+                lexical = []
+            fused = reciprocal_rank_fusion({"vector": vector, "lexical": lexical}, k=RRF_K, top_k=1)
+            if fused:
+                best = fused[0]
+                solution_text = best['metadata'].get('solution', "No solution found")
+                # Keep the cosine score as confidence when the vector index found this passage
+                confidence = best['sources'].get('vector')
+                source = "Pinecone" if 'lexical' not in best['sources'] else ("Hybrid" if confidence is not None else "Lexical")
+                state.solution = Solution(
+                    solution=solution_text, confidence=confidence if confidence is not None else 0.5, source=source
+                )
+                await run_blocking(
+                    "cache", self.response_cache.store, embedding, state.solution.model_dump(), time.perf_counter() - started
+                )
+                self.logger.info(f"Retrieved solution from {source} retrieval ({VECTOR_BACKEND} index): {solution_text}")
                 return state
         except Exception as e:
-            self.logger.error(f"Pinecone query failed: {e}")
+            self.logger.error(f"Solution retrieval failed: {e}")
 
-        solutions = {
-            "no_sound": "Check if the sound system is turned on and cables are connected.",
-            "tv_not_turning_on": "Ensure the TV is plugged in and the power cable is secure.",
-            "settings_issue": "Navigate to the settings menu and verify the correct input source.",
-            "error_code": "Note the flashing light pattern and consult the device manual."
-        }
-        solution_text = solutions.get(state.issue, "Issue not recognized. Please provide more details.")
+        solution_text = FALLBACK_SOLUTIONS.get(state.issue, "Issue not recognized. Please provide more details.")
         state.solution = Solution(solution=solution_text, confidence=0.5, source="Fallback")
         self.logger.info(f"Retrieved fallback solution: {solution_text}")
         return state
@@ -230,13 +615,51 @@ class ChatAgent:
         self.logger.info(f"Generated response: {response}")
         return state
 
-    async def process_input(self, input_type: str, input_data: Any) -> Dict[str, Any]:
+    def open_voice_stream(self, sample_rate_hertz: int = 16000,
+                          on_partial: Optional[Callable[[str, str], None]] = None,
+                          on_issue: Optional[Callable[[str, str], None]] = None) -> VoiceStream:
+        """Start streaming recognition for a voice message that is still being uploaded.
+
+        on_partial(transcript, stable_transcript) reports interim transcripts. As soon
+        as the first stable partial arrives the issue is identified from it and
+        reported through on_issue(issue, stable_transcript), before the upload ends.
+        """
+        def on_stable(text: str):
+            issue = self.identify_issue(text)
+            self.logger.info(f"Provisional issue from stable partial transcript: {issue}")
+            if on_issue:
+                on_issue(issue, text)
+
+        return VoiceStream(self.speech_client, sample_rate_hertz=sample_rate_hertz,
+                           on_partial=on_partial, on_stable=on_stable)
+
+    async def finish_voice_stream(self, stream: VoiceStream) -> Dict[str, Any]:
+        """Close the stream, wait for the final transcript and answer it."""
+        stream.close()
+        try:
+            transcript = await asyncio.wrap_future(stream.future)
+        except Exception as e:
+            self.logger.error(f"Error processing voice stream: {e}")
+            transcript = ""
+        result = await self.process_input("voice", None, transcript=transcript or "No speech detected")
+        result["transcript"] = transcript
+        return result
+
+    async def process_input(self, input_type: str, input_data: Any, transcript: Optional[str] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
         state = AgentState(
             input_type=input_type,
             input_data=input_data if input_type != "text" else None,
-            query=ClientQuery(query=input_data if input_type == "text" else "", timestamp=time.strftime("%Y-%m-%d %H:%M:%S"))
+            query=ClientQuery(query=input_data if input_type == "text" else "", timestamp=time.strftime("%Y-%m-%d %H:%M:%S")),
+            processed_input=transcript,
+            trace_id=uuid.uuid4().hex
         )
+        if isinstance(input_data, (bytes, str)):
+            PAYLOAD_BYTES.observe(len(input_data), stage=f"{input_type}_input")
         result = await self.app.ainvoke(state)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, input_type=input_type)
+        self.logger.info(f"Request {result.trace_id} timings: {result.timings}")
+        result.result["trace_id"] = result.trace_id
         return result.result
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import logging
+import struct
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TARGET_SAMPLE_RATE = 16000
+VAD_FRAME_SECONDS = 0.02
+VAD_PAD_SECONDS = 0.2
+# A frame is speech when its energy is within VAD_RANGE_DB of the loudest frame and above VAD_FLOOR_DBFS
+VAD_RANGE_DB = 35.0
+VAD_FLOOR_DBFS = -50.0
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def parse_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """Decode a RIFF/WAVE file into float32 samples shaped (frames, channels) and its sample rate.
+
+    Supports 8/16/24/32-bit integer PCM and 32/64-bit float; raises ValueError otherwise.
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a RIFF/WAVE file")
+    fmt = None
+    samples = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id, size = struct.unpack_from("<4sI", data, offset)
+        body = data[offset + 8:offset + 8 + size]
+        if chunk_id == b"fmt ":
+            if len(body) < 16:
+                raise ValueError("WAV fmt chunk is truncated")
+            fmt = struct.unpack_from("<HHIIHH", body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # The real format tag is the first two bytes of the sub-format GUID
+                fmt = (struct.unpack_from("<H", body, 24)[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            samples = body
+        offset += 8 + size + (size & 1)
+    if fmt is None or samples is None:
+        raise ValueError("WAV file is missing its fmt or data chunk")
+
+    format_tag, channels, sample_rate, _, block_align, bits = fmt
+    width = bits // 8
+    if not channels or not sample_rate or not width or bits % 8 or block_align != channels * width:
+        raise ValueError(f"Invalid WAV fmt: {channels} channels, {sample_rate} Hz, "
+                         f"{bits} bits, block align {block_align}")
+    samples = samples[:len(samples) - len(samples) % block_align]
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and width in (4, 8):
+        pcm = np.frombuffer(samples, dtype=f"<f{width}").astype(np.float32)
+    elif format_tag == WAVE_FORMAT_PCM and width == 1:
+        pcm = (np.frombuffer(samples, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif format_tag == WAVE_FORMAT_PCM and width in (2, 4):
+        pcm = np.frombuffer(samples, dtype=f"<i{width}").astype(np.float32) / float(2 ** (bits - 1))
+    elif format_tag == WAVE_FORMAT_PCM and width == 3:
+        raw = np.frombuffer(samples, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        pcm = (np.where(values & 0x800000, values - 0x1000000, values) / float(2 ** 23)).astype(np.float32)
+    else:
+        raise ValueError(f"Unsupported WAV encoding: format {format_tag:#x}, {bits} bits")
+    return pcm.reshape(-1, channels), sample_rate
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """Average all channels into one."""
+    return samples.mean(axis=1, dtype=np.float32) if samples.ndim == 2 else samples
+
+
+def resample(samples: np.ndarray, rate: int, target_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """Band-limited resampling of a mono signal by truncating (or zero-padding) its spectrum."""
+    if rate == target_rate or not len(samples):
+        return samples
+    out_length = int(round(len(samples) * target_rate / rate))
+    spectrum = np.fft.rfft(samples)
+    return (np.fft.irfft(spectrum, out_length) * (out_length / len(samples))).astype(np.float32)
+
+
+def trim_silence(samples: np.ndarray, rate: int) -> np.ndarray:
+    """Strip leading and trailing frames whose energy is below the speech threshold, keeping some padding."""
+    frame = max(1, int(rate * VAD_FRAME_SECONDS))
+    count = len(samples) // frame
+    if not count:
+        return samples
+    frames = samples[:count * frame].reshape(count, frame)
+    energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-12)
+    threshold = max(float(energy_db.max()) - VAD_RANGE_DB, VAD_FLOOR_DBFS)
+    voiced = np.flatnonzero(energy_db >= threshold)
+    if not voiced.size:
+        return samples[:0]
+    pad = int(VAD_PAD_SECONDS / VAD_FRAME_SECONDS)
+    start = max(0, voiced[0] - pad) * frame
+    end = min(count, voiced[-1] + 1 + pad) * frame
+    return samples[start:end]
+
+
+def to_linear16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def prepare_speech_audio(data: bytes, target_rate: int = TARGET_SAMPLE_RATE,
+                         trim: bool = True) -> Tuple[bytes, Dict[str, Any]]:
+    """Turn an uploaded WAV into headerless mono LINEAR16 at target_rate with silence trimmed.
+
+    Returns the PCM bytes and a report of bytes and seconds saved. Module-level
+    so it can run on the CPU executor.
+    """
+    samples, rate = parse_wav(data)
+    seconds_in = len(samples) / rate if rate else 0.0
+    mono = resample(downmix(samples), rate, target_rate)
+    if trim:
+        mono = trim_silence(mono, target_rate)
+    pcm = to_linear16(mono)
+    seconds_out = len(mono) / target_rate
+    return pcm, {
+        "input_rate": rate,
+        "input_channels": samples.shape[1],
+        "sample_rate": target_rate,
+        "bytes_in": len(data),
+        "bytes_out": len(pcm),
+        "bytes_saved": len(data) - len(pcm),
+        "seconds_in": round(seconds_in, 3),
+        "seconds_out": round(seconds_out, 3),
+        "seconds_saved": round(seconds_in - seconds_out, 3),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    path = sys.argv[1] if len(sys.argv) > 1 else "/home/vincent/ixome/notebooks/test_audio.wav"
+    with open(path, "rb") as f:
+        raw = f.read()
+    started = time.perf_counter()
+    _, report = prepare_speech_audio(raw)
+    print(f"Prepared in {(time.perf_counter() - started) * 1000:.1f} ms: {report}")
@@ -0,0 +1,40 @@
+import os
+import time
+import uuid
+from typing import Optional
+
+import jwt
+
+# Same secret and claims as flask_jwt_extended, so tokens from either app work in both
+JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your_default_jwt_secret_key')
+JWT_ACCESS_TOKEN_EXPIRES = int(os.environ.get('JWT_ACCESS_TOKEN_EXPIRES', '900'))
+JWT_ALGORITHM = "HS256"
+
+
+def create_access_token(identity: str) -> str:
+    now = int(time.time())
+    payload = {
+        "sub": identity,
+        "iat": now,
+        "nbf": now,
+        "exp": now + JWT_ACCESS_TOKEN_EXPIRES,
+        "jti": uuid.uuid4().hex,
+        "type": "access",
+        "fresh": False,
+    }
+    return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+
+
+def decode_identity(token: str) -> str:
+    """Return the identity of a valid access token; raises jwt.InvalidTokenError otherwise."""
+    payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    if payload.get("type", "access") != "access":
+        raise jwt.InvalidTokenError("Not an access token")
+    return payload["sub"]
+
+
+def bearer_token(header: Optional[str]) -> Optional[str]:
+    """Extract the token from an 'Authorization: Bearer <token>' header value."""
+    if header and header[:7].lower() == "bearer ":
+        return header[7:].strip()
+    return None
@@ -0,0 +1,21 @@
+from typing import List
+
+# Embedding models tokenize English at roughly 1.3 tokens per word, so word
+# windows keep passages comfortably inside a token budget without a tokenizer.
+TOKENS_PER_WORD = 1.3
+
+
+def chunk_text(text: str, max_tokens: int = 256, overlap_tokens: int = 32) -> List[str]:
+    """Split text into overlapping passages of at most ``max_tokens`` (approximate) tokens."""
+    words = (text or "").split()
+    if not words:
+        return []
+    window = max(1, int(max_tokens / TOKENS_PER_WORD))
+    overlap = min(int(overlap_tokens / TOKENS_PER_WORD), window - 1)
+    stride = window - overlap
+    passages = []
+    for start in range(0, len(words), stride):
+        passages.append(" ".join(words[start:start + window]))
+        if start + window >= len(words):
+            break
+    return passages
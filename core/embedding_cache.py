@@ -0,0 +1,160 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Collapse case and whitespace so trivially different phrasings share a cache key."""
+    return " ".join((text or "").lower().split())
+
+
+def cache_key(text: str, model: str) -> str:
+    """Build the cache key from the embedding model and the normalized text."""
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: an in-process LRU in front of an optional SQLite file.
+
+    Vectors are stored as float32. The disk tier is evicted least-recently-used
+    first once its payload exceeds ``max_disk_bytes``.
+    """
+
+    def __init__(self, max_entries: int = 10000, disk_path: Optional[str] = None,
+                 max_disk_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._inherited = []
+        self._disk_bytes = 0
+        self._disk_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """Return this process's connection to the disk tier, opening it on first use.
+
+        A SQLite connection must not be used across a fork, so a worker forked
+        from a process that already had one opens its own; the inherited handle
+        is kept but never touched, since closing it could disturb the parent's locks.
+        """
+        if not self.disk_path:
+            return None
+        if self._db_pid != os.getpid():
+            if self._db is not None:
+                self._inherited.append(self._db)
+            self._open_disk(self.disk_path)
+        return self._db
+
+    def _open_disk(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db_pid = os.getpid()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, vector BLOB, size INTEGER, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._db.commit()
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        logger.info(f"Opened embedding cache at {path} ({self._disk_bytes} bytes)")
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        """Return the cached embedding for ``text`` or None on a miss."""
+        key = cache_key(text, model)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+            db = self._disk()
+            if db is not None:
+                row = db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    db.commit()
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector.tolist()
+            self.misses += 1
+            return None
+
+    def put(self, text: str, model: str, embedding: List[float]):
+        """Store ``embedding`` in both tiers."""
+        key = cache_key(text, model)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._disk() is not None:
+                self._write_disk(key, model, vector)
+
+    def get_or_create(self, text: str, model: str, embed: Callable[[str], List[float]]) -> List[float]:
+        """Return the cached embedding, calling ``embed`` and caching the result on a miss."""
+        embedding = self.get(text, model)
+        if embedding is None:
+            embedding = embed(text)
+            self.put(text, model, embedding)
+        return embedding
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _write_disk(self, key: str, model: str, vector: np.ndarray):
+        blob = vector.tobytes()
+        previous = self._db.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+        self._db.execute(
+            "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, model, blob, len(blob), time.time())
+        )
+        self._disk_bytes += len(blob) - (previous[0] if previous else 0)
+        self._recount_disk()
+        while self._disk_bytes > self.max_disk_bytes:
+            oldest = self._db.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if oldest is None:
+                break
+            self._db.execute("DELETE FROM embeddings WHERE key = ?", (oldest[0],))
+            self._disk_bytes -= oldest[1]
+            self.evictions += 1
+        self._db.commit()
+
+    def _recount_disk(self):
+        # Other worker processes write to the same file, so the running total is re-read now and then
+        self._disk_writes += 1
+        if self._disk_writes % 256 == 0:
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "disk_evictions": self.evictions,
+            }
@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Default worker threads per stage; override with STAGE_LIMIT_<STAGE>, e.g. STAGE_LIMIT_SPEECH=8.
+# Each stage has its own pool, so a burst of slow video uploads cannot starve text queries.
+STAGE_LIMITS = {
+    "embedding": 8,
+    "index": 8,
+    "speech": 4,
+    # Each streaming recognition holds a worker for the length of the upload
+    "speech_stream": 16,
+    "vision": 4,
+    "video": 2,
+    # Subscription lookups and token-ledger writes from async handlers
+    "strapi": 8,
+    # Embedding, media and response cache reads and writes; their disk tiers are files shared by workers
+    "cache": 8,
+}
+# Worker processes for CPU-heavy frame work. 0 keeps it on the "video" thread pool
+# (OpenCV releases the GIL while decoding). Processes are spawned, so the entry
+# module must be safe to import in a child.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0"))
+
+_lock = threading.Lock()
+_thread_pools: Dict[str, ThreadPoolExecutor] = {}
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def stage_limit(stage: str) -> int:
+    return int(os.getenv(f"STAGE_LIMIT_{stage.upper()}", STAGE_LIMITS.get(stage, 4)))
+
+
+def stage_executor(stage: str) -> ThreadPoolExecutor:
+    """Return the bounded thread pool for a stage, creating it on first use."""
+    pool = _thread_pools.get(stage)
+    if pool is None:
+        with _lock:
+            pool = _thread_pools.get(stage)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=stage_limit(stage), thread_name_prefix=f"chat-{stage}")
+                _thread_pools[stage] = pool
+    return pool
+
+
+def cpu_executor() -> Executor:
+    """Return the process pool for CPU-heavy work, or the video thread pool when CPU_WORKERS is 0."""
+    global _process_pool
+    if CPU_WORKERS <= 0:
+        return stage_executor("video")
+    if _process_pool is None:
+        with _lock:
+            if _process_pool is None:
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _process_pool
+
+
+async def run_blocking(stage: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking call on the stage's thread pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await loop.run_in_executor(stage_executor(stage), call)
+
+
+async def run_cpu(fn: Callable[..., Any], *args) -> Any:
+    """Run a picklable, module-level function on the CPU pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor(), functools.partial(fn, *args))
+
+
+def shutdown(wait: bool = True):
+    """Stop all pools; they are recreated on next use."""
+    global _process_pool
+    with _lock:
+        pools = list(_thread_pools.values())
+        _thread_pools.clear()
+        process_pool, _process_pool = _process_pool, None
+    for pool in pools:
+        pool.shutdown(wait=wait)
+    if process_pool is not None:
+        process_pool.shutdown(wait=wait)
+
+
+def _reset_after_fork():
+    # Pool threads and their locks do not exist in a forked child; start over with fresh pools
+    global _lock, _process_pool
+    _lock = threading.Lock()
+    _thread_pools.clear()
+    _process_pool = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -2,181 +2,281 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from agents.chat_agent import ChatAgent
+import asyncio
 import logging
-import requests
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
 
-# Debug: Confirm script is running
-print("Starting flask_app.py execution")
+# Load environment variables before the core modules read their settings
+load_dotenv()
+
+import jwt
+import socketio
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from agents.chat_agent import ChatAgent
+from core.auth import bearer_token, create_access_token, decode_identity
+from core.executors import run_blocking
+from core.http_client import http
+from core.issue_rules import is_technical
+from core.metrics import registry
+from core.socketio_affinity import AffinityMiddleware, start_relay_server, stop_relay_server, tag_session_ids
+from core.subscriptions import SubscriptionService, subscriptions_from_env
 
-# Initialize Flask app
-print("Initializing Flask app")
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your_secret_key')
-CORS(app, resources={r"/*": {"origins": "[invalid url, do not cite] supports_credentials=True)
-socketio = SocketIO(app, cors_allowed_origins="[invalid url, do not cite]
+# Production ASGI entry point: one event loop, one ChatAgent and one Socket.IO server per worker.
+# Run with: uvicorn core.fast_API:asgi_app --host 0.0.0.0 --port 5001
+# or with several workers: gunicorn -c gunicorn.conf.py core.fast_API:asgi_app
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-print("Logging configured")
 
-# Initialize ChatAgent instance
-print("Initializing ChatAgent")
-try:
+CORS_ORIGINS = ["http://localhost:3000", "https://ixome.ai"]
+SOCKETIO_TRANSPORTS = os.environ.get('SOCKETIO_TRANSPORTS', 'polling,websocket').split(',')
+# With several workers, relay each Engine.IO request to the worker that owns its session
+# (see core.socketio_affinity), so long-polling clients work without sticky routing
+SOCKETIO_AFFINITY = os.environ.get('SOCKETIO_AFFINITY', '0') == '1'
+SUBSCRIBE_TEXT = ("This looks like a technical issue! I can solve one easy problem for free. If it’s complex, "
+                  "please subscribe to one of our plans: $10 (1 problem), $20 (3 problems), or $149 (100 problems). "
+                  "Visit /support to subscribe!")
+
+# Created per worker on startup, after any fork; read-only indexes preloaded by the
+# master (see gunicorn.conf.py) are reused rather than loaded again
+agent: Optional[ChatAgent] = None
+subscriptions: Optional[SubscriptionService] = None
+llm = None
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global agent, subscriptions
+    logger.info("Initializing ChatAgent")
     agent = ChatAgent()
+    subscriptions = subscriptions_from_env(session=http)
     logger.info("ChatAgent initialized successfully")
-    print("ChatAgent initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize ChatAgent: {str(e)}")
-    print(f"Failed to initialize ChatAgent: {str(e)}")
-    raise
-
-# Initialize LangChain for AI responses
-print("Initializing LangChain")
-try:
-    llm = ChatOpenAI(
-        model_name="gpt-3.5-turbo",
-        openai_api_key=os.environ.get("OPENAI_API_KEY", "your_openai_api_key"),
-        temperature=0.7
-    )
-    logger.info("LangChain initialized successfully")
-    print("LangChain initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize LangChain: {str(e)}")
-    print(f"Failed to initialize LangChain: {str(e)}")
-    raise
-
-# Define the /process route
-@app.route('/process', methods=['POST'])
-async def process():
-    """
-    Process incoming POST requests with input_type and input_data.
-    Returns a JSON response with the result from ChatAgent or an error message.
+    relay = await start_relay_server(sio_app) if SOCKETIO_AFFINITY else None
+    yield
+    if relay is not None:
+        await stop_relay_server(relay)
+    await run_blocking("strapi", subscriptions.ledger.stop)
+    http.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=CORS_ORIGINS, allow_credentials=True,
+                   allow_methods=["*"], allow_headers=["*"])
+
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins=CORS_ORIGINS, transports=SOCKETIO_TRANSPORTS)
+sio_app = socketio.ASGIApp(sio, other_asgi_app=app)
+if SOCKETIO_AFFINITY:
+    tag_session_ids(sio.eio)
+    asgi_app = AffinityMiddleware(sio_app)
+else:
+    asgi_app = sio_app
+
+
+def current_user(authorization: Optional[str] = Header(None)) -> str:
+    try:
+        return decode_identity(bearer_token(authorization) or "")
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+
+
+async def check_subscription(user_id: str) -> bool:
+    try:
+        return await run_blocking("strapi", subscriptions.is_entitled, user_id)
+    except Exception as e:
+        logger.error(f"Error checking subscription: {str(e)}")
+        return False
+
+
+def get_llm():
+    """LangChain chat model used when ChatAgent fails; created on first use."""
+    global llm
+    if llm is None:
+        from langchain.chat_models import ChatOpenAI
+        llm = ChatOpenAI(model_name="gpt-3.5-turbo", openai_api_key=os.environ.get("OPENAI_API_KEY"), temperature=0.7)
+    return llm
+
+
+async def process_message(user_id: str, message_text: str) -> Dict[str, Any]:
+    """Answer a chat message, enforcing the subscription for technical questions.
+
+    The reply's 'billable' flag says whether record_usage must charge a token
+    once the answer has been delivered.
     """
+    technical = is_technical(message_text)
+    entitled = technical and await check_subscription(user_id)
+    if technical and not entitled:
+        return {'text': SUBSCRIBE_TEXT, 'redirect': '/support'}
+    try:
+        result = await agent.process_input("text", message_text)
+    except Exception as e:
+        logger.error(f"ChatAgent failed, falling back to LangChain: {str(e)}")
+        from langchain.schema import HumanMessage
+        result = (await get_llm().ainvoke([HumanMessage(content=message_text)])).content
+    return {'text': result, 'technical': technical, 'billable': entitled}
+
+
+async def record_usage(user_id: str, reply: Dict[str, Any]):
+    """Charge a token for a delivered technical answer; a local ledger write, flushed to Strapi later."""
+    if reply.get('billable'):
+        await run_blocking("strapi", subscriptions.consume_token, user_id)
+
+
+# HTTP routes
+@app.post('/login')
+async def login(request: Request):
+    data = await request.json()
+    # TODO: Replace with proper authentication (e.g., Strapi or database)
+    if data.get('username') == 'test' and data.get('password') == 'test':
+        return {'access_token': create_access_token(data['username'])}
+    return JSONResponse({"msg": "Bad credentials"}, status_code=401)
+
+
+@app.post('/process')
+async def process(request: Request, user: str = Depends(current_user)):
     try:
-        data = request.get_json()
-        logger.info(f"Received request data: {data}")
-        print(f"Received request data: {data}")
-        
+        data = await request.json()
         if not data or 'input_type' not in data or 'input_data' not in data:
-            logger.warning("Invalid input data received")
-            print("Invalid input data received")
-            return jsonify({'error': 'Invalid input data'}), 400
-        
-        if not data['input_data'].strip():
-            logger.warning("Empty input data received")
-            print("Empty input data received")
-            return jsonify({'error': 'Input data cannot be empty'}), 400
-        
+            return JSONResponse({'error': 'Invalid input data'}, status_code=400)
+        if not str(data['input_data']).strip():
+            return JSONResponse({'error': 'Input data cannot be empty'}, status_code=400)
+        logger.info(f"Processing {data['input_type']} request for user: {user}")
         result = await agent.process_input(data['input_type'], data['input_data'])
-        logger.info(f"ChatAgent result: {result}")
-        print(f"ChatAgent result: {result}")
-        
-        return jsonify({'result': result})
-    
+        return {'result': result}
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
-        print(f"Error processing request: {str(e)}")
-        return jsonify({'error': f"Server error: {str(e)}"}), 500
+        return JSONResponse({'error': f"Server error: {str(e)}"}, status_code=500)
 
-# Define the /cometchat-webhook route (for legacy compatibility)
-@app.route('/cometchat-webhook', methods=['POST'])
-async def cometchat_webhook():
+
+# Legacy CometChat webhook
+@app.post('/cometchat-webhook')
+async def cometchat_webhook(request: Request):
     try:
-        data = request.get_json()
+        data = await request.json()
         user_id = data["sender"]["uid"]
-        message_text = data["data"]["text"]
-        
-        result = await process_message(user_id, message_text)
-        
-        return jsonify({"status": "success"})
+        await record_usage(user_id, await process_message(user_id, data["data"]["text"]))
+        return {"status": "success"}
     except Exception as e:
         logger.error(f"Error in webhook: {str(e)}")
-        print(f"Error in webhook: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@app.get('/metrics')
+async def metrics():
+    return PlainTextResponse(registry.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/stats')
+async def stats():
+    # The ledger and the shared response cache are read under file locks, so not on the event loop
+    return {'http': http.stats(), 'subscriptions': subscriptions.stats(),
+            'token_ledger': await run_blocking("strapi", subscriptions.ledger.stats),
+            'caches': await run_blocking("cache", agent.cache_stats)}
+
+
+@app.get('/')
+async def home():
+    return PlainTextResponse("ASGI app is running!")
+
 
 # Socket.IO event handlers
-@socketio.on('connect')
-def handle_connect():
-    logger.info("Client connected")
-    print("Client connected")
-    emit('response', {'text': 'Connected to ixome.ai chatbot!'})
-
-@socketio.on('message')
-async def handle_message(data):
+@sio.event
+async def connect(sid, environ, auth=None):
+    token = (auth or {}).get('token') or bearer_token(environ.get('HTTP_AUTHORIZATION'))
     try:
-        user_id = data.get('user_id', 'anonymous')
-        message_text = data.get('text', '')
-        if not message_text.strip():
-            emit('response', {'text': 'Please enter a message.'})
+        user = decode_identity(token or "")
+    except jwt.InvalidTokenError as e:
+        logger.warning(f"Rejected Socket.IO connection: {e}")
+        raise socketio.exceptions.ConnectionRefusedError('authentication failed')
+    await sio.save_session(sid, {'user': user})
+    logger.info(f"User {user} connected")
+    await sio.emit('response', {'text': f"Hey {user}! Welcome to ixome.ai chatbot! How can I help you today?"}, to=sid)
+
+
+@sio.event
+async def message(sid, data):
+    user = (await sio.get_session(sid))['user']
+    user_message = (data or {}).get('text', '').strip()
+    if not user_message:
+        await sio.emit('response', {'text': 'Oops! Please type a message to get started!'}, to=sid)
+        return
+    logger.info(f"User {user} sent: {user_message}")
+    try:
+        reply = await process_message(user, user_message)
+        if 'redirect' in reply:
+            await sio.emit('response', {'text': reply['text'], 'redirect': reply['redirect']}, to=sid)
             return
-        
-        result = await process_message(user_id, message_text)
-        emit('response', {'text': result})
+        await sio.emit('response', {'text': reply['text']}, to=sid)
+        await record_usage(user, reply)
+        if reply['technical']:
+            await sio.emit('response', {'text': "Follow-up: Need more help? Ask another question or let me know!"}, to=sid)
     except Exception as e:
-        logger.error(f"Error handling message: {str(e)}")
-        print(f"Error handling message: {str(e)}")
-        emit('response', {'text': f"Error: {str(e)}"})
-
-async def process_message(user_id, message_text):
-    # Classify message as technical or non-technical
-    is_technical = classify_message(message_text)
-    
-    if is_technical:
-        # Check subscription status via Strapi
-        if not check_subscription(user_id):
-            return "Please subscribe to our support plan for technical assistance."
-    
-    # Process with ChatAgent or LangChain
+        logger.error(f"Error processing message: {str(e)}")
+        await sio.emit('response', {'text': f"Oops! Something went wrong. Try again later! ({str(e)})"}, to=sid)
+
+
+# Streaming voice messages: voice_start, any number of voice_chunk events, then voice_end
+voice_streams: Dict[str, Any] = {}
+
+
+@sio.event
+async def voice_start(sid, data=None):
+    loop = asyncio.get_running_loop()
+    sample_rate = int((data or {}).get('sample_rate', 16000))
+
+    def emit_threadsafe(event, payload):
+        # Recognition callbacks run on a worker thread
+        asyncio.run_coroutine_threadsafe(sio.emit(event, payload, to=sid), loop)
+
+    old = voice_streams.pop(sid, None)
+    if old:
+        old.close()
+    voice_streams[sid] = agent.open_voice_stream(
+        sample_rate_hertz=sample_rate,
+        on_partial=lambda text, stable: emit_threadsafe('partial_transcript', {'text': text, 'stable': stable}),
+        on_issue=lambda issue, text: emit_threadsafe('provisional_issue', {'issue': issue, 'text': text})
+    )
+
+
+@sio.event
+async def voice_chunk(sid, chunk):
+    stream = voice_streams.get(sid)
+    if stream is None:
+        await sio.emit('response', {'text': 'Oops! Start a voice message before sending audio.'}, to=sid)
+        return
     try:
-        result = await agent.process_input("text", message_text)
-    except Exception:
-        # Fallback to LangChain
-        messages = [HumanMessage(content=message_text)]
-        result = llm(messages).content
-    
-    return result
-
-def classify_message(text):
-    # Simple keyword-based classification
-    technical_keywords = ["error", "bug", "crash", "install", "configure", "troubleshoot"]
-    return any(keyword in text.lower() for keyword in technical_keywords)
-
-def check_subscription(user_id):
+        stream.feed(chunk)
+    except RuntimeError as e:
+        logger.error(f"Dropping voice chunk: {str(e)}")
+
+
+@sio.event
+async def voice_end(sid):
+    stream = voice_streams.pop(sid, None)
+    if stream is None:
+        await sio.emit('response', {'text': 'Oops! No voice message in progress.'}, to=sid)
+        return
     try:
-        response = requests.get(f"[invalid url, do not cite])
-        if response.status_code == 200:
-            subscriptions = response.json()['data']
-            if subscriptions:
-                subscription = subscriptions[0]['attributes']
-                tier = subscription['tier']
-                problems_solved = subscription['problems_solved']
-                if tier == "one_problem" and problems_solved < 1:
-                    return True
-                elif tier == "three_problems" and problems_solved < 3:
-                    return True
-                elif tier == "unlimited" and problems_solved < 100:
-                    return True
-        return False
+        result = await agent.finish_voice_stream(stream)
+        await sio.emit('response', {'text': result}, to=sid)
     except Exception as e:
-        logger.error(f"Error checking subscription: {str(e)}")
-        print(f"Error checking subscription: {str(e)}")
-        return False
+        logger.error(f"Error processing voice stream: {str(e)}")
+        await sio.emit('response', {'text': f"Oops! Something went wrong. Try again later! ({str(e)})"}, to=sid)
+
 
-# Wrap Flask app for ASGI compatibility
-print("Wrapping Flask app with WsgiToAsgi")
-asgi_app = SocketIO(app)
+@sio.event
+async def disconnect(sid):
+    stream = voice_streams.pop(sid, None)
+    if stream:
+        stream.close()
 
-@app.route('/')
-def home():
-    return "Flask app is running!"
 
 if __name__ == '__main__':
+    import uvicorn
     port = int(os.environ.get('PORT', 5001))
-    socketio.run(app, host='0.0.0.0', port=port)
\ No newline at end of file
+    uvicorn.run(asgi_app, host='0.0.0.0', port=port)
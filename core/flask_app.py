@@ -7,10 +7,13 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_socketio import SocketIO, emit
 from agents.chat_agent import ChatAgent
+from core.metrics import registry
+from core.issue_rules import is_technical
+from core.subscriptions import subscriptions_from_env
+from core.http_client import http
 import logging
 from asgiref.wsgi import WsgiToAsgi
 from dotenv import load_dotenv
-import requests
 
 # Load environment variables
 load_dotenv()
@@ -46,21 +49,14 @@ except Exception as e:
     print(f"Failed to initialize ChatAgent: {str(e)}")
     raise
 
-# Strapi API configuration
-STRAPI_URL = os.environ.get('STRAPI_URL', 'http://localhost:1337')
+# Strapi subscriptions: lookups cached per user for SUBSCRIPTION_CACHE_TTL seconds, consumed tokens
+# recorded locally and written to Strapi every TOKEN_FLUSH_INTERVAL seconds (see core.subscriptions)
+subscriptions = subscriptions_from_env(session=http)
+token_ledger = subscriptions.ledger
 
 def check_subscription(user_id):
     try:
-        response = requests.get(f"{STRAPI_URL}/api/users?filters[username][$eq]={user_id}", headers={'Authorization': 'Bearer your_strapi_jwt'})
-        if response.status_code == 200:
-            user = response.json().get('data', [{}])[0]
-            if user:
-                subscription = user.get('attributes', {}).get('subscription', {})
-                tokens = subscription.get('tokens', 0)
-                if tokens > 0 or (not user.get('attributes', {}).get('first_visit_done', False)):
-                    return True
-                return False
-        return False
+        return subscriptions.is_entitled(user_id)
     except Exception as e:
         logger.error(f"Error checking subscription: {str(e)}")
         return False
@@ -83,10 +79,11 @@ async def handle_message(data):
         return
 
     logger.info(f"User {current_user} sent: {user_message}")
-    is_technical = any(keyword in user_message.lower() for keyword in ["error", "bug", "crash", "install", "configure"])
+    technical = is_technical(user_message)
+    entitled = technical and check_subscription(current_user)
 
-    if is_technical:
-        if not check_subscription(current_user):
+    if technical:
+        if not entitled:
             emit('response', {
                 'text': "This looks like a technical issue! I can solve one easy problem for free. If it’s complex, please subscribe to one of our plans: $10 (1 problem), $20 (3 problems), or $149 (100 problems). Visit /support to subscribe!",
                 'redirect': '/support'
@@ -96,15 +93,64 @@ async def handle_message(data):
     try:
         result = await agent.process_input("text", user_message)
         emit('response', {'text': result})
-        if is_technical and check_subscription(current_user):
-            tokens = requests.get(f"{STRAPI_URL}/api/users?filters[username][$eq]={current_user}", headers={'Authorization': 'Bearer your_strapi_jwt'}).json().get('data', [{}])[0].get('attributes', {}).get('subscription', {}).get('tokens', 0) - 1
-            requests.put(f"{STRAPI_URL}/api/users/{current_user}", json={'tokens': tokens}, headers={'Authorization': 'Bearer your_strapi_jwt'})
+        if entitled:
+            subscriptions.consume_token(current_user)
             emit('response', {'text': "Follow-up: Need more help? Ask another question or let me know!"})
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
         emit('response', {'text': f"Oops! Something went wrong. Try again later! ({str(e)})"})
 
 
+# Streaming voice messages: voice_start, any number of voice_chunk events, then voice_end
+voice_streams = {}
+
+@socketio.on('voice_start')
+@jwt_required()
+def handle_voice_start(data=None):
+    sid = request.sid
+    sample_rate = int((data or {}).get('sample_rate', 16000))
+    old = voice_streams.pop(sid, None)
+    if old:
+        old.close()
+    voice_streams[sid] = agent.open_voice_stream(
+        sample_rate_hertz=sample_rate,
+        on_partial=lambda text, stable: socketio.emit('partial_transcript', {'text': text, 'stable': stable}, to=sid),
+        on_issue=lambda issue, text: socketio.emit('provisional_issue', {'issue': issue, 'text': text}, to=sid)
+    )
+    logger.info(f"User {get_jwt_identity()} started a voice stream at {sample_rate} Hz")
+
+@socketio.on('voice_chunk')
+@jwt_required()
+def handle_voice_chunk(chunk):
+    stream = voice_streams.get(request.sid)
+    if stream is None:
+        emit('response', {'text': 'Oops! Start a voice message before sending audio.'})
+        return
+    try:
+        stream.feed(chunk)
+    except RuntimeError as e:
+        logger.error(f"Dropping voice chunk: {str(e)}")
+
+@socketio.on('voice_end')
+@jwt_required()
+async def handle_voice_end():
+    stream = voice_streams.pop(request.sid, None)
+    if stream is None:
+        emit('response', {'text': 'Oops! No voice message in progress.'})
+        return
+    try:
+        result = await agent.finish_voice_stream(stream)
+        emit('response', {'text': result})
+    except Exception as e:
+        logger.error(f"Error processing voice stream: {str(e)}")
+        emit('response', {'text': f"Oops! Something went wrong. Try again later! ({str(e)})"})
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    stream = voice_streams.pop(request.sid, None)
+    if stream:
+        stream.close()
+
 # Define the /login route
 @app.route('/login', methods=['POST'])
 def login():
@@ -137,6 +183,15 @@ async def process():
         logger.error(f"Error processing request: {str(e)}")
         return jsonify({'error': f"Server error: {str(e)}"}), 500
 
+@app.route('/metrics')
+def metrics():
+    return registry.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/stats')
+def stats():
+    return jsonify({'http': http.stats(), 'subscriptions': subscriptions.stats(), 'token_ledger': token_ledger.stats(),
+                    'caches': agent.cache_stats()})
+
 @app.route('/')
 def home():
     return "Flask app is running!"
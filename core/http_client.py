@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+# Keep-alive connections kept per host, and the most requests allowed in flight to one host
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+
+
+class HostStats:
+    __slots__ = ("requests", "errors", "in_flight", "peak_in_flight", "queued", "seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.queued = 0
+        self.seconds = 0.0
+
+
+class HttpClient:
+    """Shared outbound HTTP layer: pooled keep-alive connections, per-host caps and default timeouts.
+
+    ``get``/``put``/``post`` use one ``requests.Session`` from any thread; async
+    code calls them through ``core.executors.run_blocking``. At most
+    ``max_per_host`` requests are in flight to a host; extra callers wait for a
+    slot instead of opening more connections.
+    """
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, max_per_host: int = HTTP_MAX_PER_HOST,
+                 timeout: Tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                 retries: int = HTTP_RETRIES):
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        # Only idempotent methods are retried, and only on connection errors and 502/503/504
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                              allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}),
+                              raise_on_status=False)
+        )
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self._lock = threading.Lock()
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._stats: Dict[str, HostStats] = {}
+
+    def _host(self, url: str) -> str:
+        return urlsplit(url).netloc
+
+    def _begin(self, host: str, waited: bool) -> HostStats:
+        with self._lock:
+            stats = self._stats.setdefault(host, HostStats())
+            stats.requests += 1
+            stats.queued += waited
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            return stats
+
+    def _end(self, stats: HostStats, started: float, failed: bool):
+        with self._lock:
+            stats.in_flight -= 1
+            stats.errors += failed
+            stats.seconds += time.perf_counter() - started
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        host = self._host(url)
+        with self._lock:
+            slots = self._host_slots.get(host)
+            if slots is None:
+                slots = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+        waited = not slots.acquire(blocking=False)
+        if waited:
+            slots.acquire()
+        stats = self._begin(host, waited)
+        started = time.perf_counter()
+        failed = True
+        try:
+            kwargs.setdefault("timeout", self.timeout)
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self._end(stats, started, failed)
+            slots.release()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-host request counters plus keep-alive pool usage of the sync session."""
+        with self._lock:
+            hosts = {
+                host: {
+                    "requests": s.requests,
+                    "errors": s.errors,
+                    "in_flight": s.in_flight,
+                    "peak_in_flight": s.peak_in_flight,
+                    "queued": s.queued,
+                    "avg_seconds": s.seconds / s.requests if s.requests else 0.0,
+                }
+                for host, s in self._stats.items()
+            }
+        pools = {}
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            # num_connections counts connections ever opened; fewer than num_requests means reuse
+            pools[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                # The queue is pre-filled with None placeholders; only real connections are idle ones
+                "idle": sum(conn is not None for conn in list(pool.pool.queue)) if pool.pool is not None else 0,
+                "max_size": self.pool_size,
+            }
+        return {"hosts": hosts, "pools": pools}
+
+    def close(self):
+        self.session.close()
+
+    def reset_after_fork(self):
+        """Drop pooled connections inherited from a parent process.
+
+        Sockets opened before a fork would be shared with the parent, so a
+        forked worker starts with empty pools and its own counters.
+        """
+        self._adapter.poolmanager.clear()
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._stats = {}
+
+
+http = HttpClient()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=http.reset_after_fork)
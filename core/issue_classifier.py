@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.issue_rules import FALLBACK_SOLUTIONS, ISSUE_RULES, IssueMatcher, issue_matcher
+from core.vector_store import EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class IssueClassifier:
+    """Nearest-centroid issue classifier over query embeddings.
+
+    Each issue label has one unit-length centroid, so classifying an embedding
+    that was already computed for retrieval is a single matrix-vector product.
+    Below ``min_score`` cosine similarity the result is ``"unknown"``.
+    """
+
+    def __init__(self, labels: Sequence[str], centroids: np.ndarray, model: Optional[str] = None,
+                 min_score: float = 0.35):
+        self.labels = list(labels)
+        self.centroids = _normalize_rows(np.asarray(centroids, dtype=np.float32))
+        self.model = model
+        self.min_score = min_score
+
+    @property
+    def dimension(self) -> int:
+        return self.centroids.shape[1]
+
+    def scores(self, embedding: Sequence[float]) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Embedding has dimension {query.shape[0]}, classifier expects {self.dimension}")
+        norm = np.linalg.norm(query)
+        return self.centroids @ (query / norm if norm else query)
+
+    def classify(self, embedding: Sequence[float]) -> Tuple[str, float]:
+        """Return (issue, cosine score) for the nearest centroid, or ("unknown", score) below min_score."""
+        scores = self.scores(embedding)
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        return (self.labels[best] if score >= self.min_score else "unknown"), score
+
+    @classmethod
+    def build(cls, examples: Dict[str, List[str]], embed: Callable[[List[str]], List[List[float]]],
+              model: Optional[str] = None, batch_size: int = 64, **kwargs) -> "IssueClassifier":
+        """Embed the example texts of each label and average them into centroids."""
+        labels, centroids = [], []
+        for label, texts in sorted(examples.items()):
+            if not texts:
+                continue
+            vectors = []
+            for i in range(0, len(texts), batch_size):
+                vectors.extend(embed(texts[i:i + batch_size]))
+            centroids.append(_normalize_rows(np.asarray(vectors, dtype=np.float32)).mean(axis=0))
+            labels.append(label)
+            logger.info(f"Centroid for {label} built from {len(texts)} examples")
+        return cls(labels, np.vstack(centroids), model=model, **kwargs)
+
+    def save(self, path: str):
+        """Write labels, centroids and model name to a .npz file atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, labels=np.array(self.labels), centroids=self.centroids, model=np.array(self.model or ""))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "IssueClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            model = str(data["model"]) or None
+            return cls([str(label) for label in data["labels"]], data["centroids"], model=model, **kwargs)
+
+
+def read_corpus(path: str) -> Iterator[dict]:
+    """Yield the JSON objects of a JSON-lines corpus, skipping malformed lines."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(item, dict):
+                yield item
+
+
+def training_examples(records: Iterable[dict], matcher: IssueMatcher = issue_matcher,
+                      solutions: Dict[str, str] = FALLBACK_SOLUTIONS,
+                      rules=ISSUE_RULES, max_per_label: int = 500) -> Dict[str, List[str]]:
+    """Collect example texts per issue label.
+
+    Every label starts with its fallback solution and rule phrases. Corpus
+    records are labeled by the keyword rules applied to their ``issue`` field
+    (weak supervision), so real phrasings from the corpus widen each centroid.
+    """
+    examples: Dict[str, List[str]] = {label: [text] for label, text in solutions.items()}
+    for label, _, phrases in rules:
+        examples.setdefault(label, []).extend(phrases)
+    for record in records:
+        issue_text = str(record.get("issue") or "").strip()
+        label = matcher.best(f"{issue_text} {record.get('solution') or ''}")
+        if label in examples and len(examples[label]) < max_per_label:
+            examples[label].append(f"{issue_text} {record.get('product') or ''}".strip())
+    return examples
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from openai import OpenAI
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build issue centroids for ChatAgent's issue classifier.")
+    parser.add_argument("corpus", nargs="?", default=os.getenv(
+        "LUTRON_DATA_PATH", "/home/vincent/ixome/scrapy-selenium/lutron_scraper/lutron_data.json"))
+    parser.add_argument("--out", default=os.getenv("ISSUE_CLASSIFIER_PATH", os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "data", "issue_centroids.npz")))
+    # Must be the model ChatAgent embeds queries with, since it classifies those embeddings
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    args = parser.parse_args()
+
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    records = read_corpus(args.corpus) if os.path.exists(args.corpus) else []
+    examples = training_examples(records)
+    classifier = IssueClassifier.build(
+        examples, lambda texts: [d.embedding for d in client.embeddings.create(model=args.model, input=texts).data],
+        model=args.model
+    )
+    classifier.save(args.out)
+    print(f"Saved {len(classifier.labels)} centroids ({classifier.dimension} dims) to {args.out}: "
+          f"{ {label: len(texts) for label, texts in examples.items()} }")
@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Words joined by - . / stay one token ("3-way", "pd-6wcl-wh") and are also indexed by their parts
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+SPLIT_RE = re.compile(r"[-./]")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in is it its my no not of on or our so the "
+    "their then there this to was what when where which will with you your".split()
+) - {"no", "not"}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens that keep model numbers and part codes intact."""
+    tokens = []
+    for token in TOKEN_RE.findall((text or "").lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if SPLIT_RE.search(token):
+            tokens.extend(part for part in SPLIT_RE.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 full-text index over the troubleshooting passages, stored in SQLite FTS5.
+
+    Passages are indexed as the tokens from ``tokenize``, so model numbers and
+    part codes match whole, and ranked with FTS5's built-in BM25. Postings and
+    metadata stay on disk, so the loader's memory does not grow with the
+    corpus. Adds and removes accumulate in one transaction that ``save``
+    commits, which means readers of the file only see checkpointed states.
+    Without a path the index lives in memory.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._inherited = []
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per process, opened on first use: SQLite connections must not cross a fork.
+        # An inherited handle is kept but never touched, since closing it could disturb the parent's locks
+        if self._db is not None and (self._pid == os.getpid() or not self.path):
+            return self._db
+        if self._db is not None:
+            self._inherited.append(self._db)
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path or ":memory:", check_same_thread=False, timeout=10)
+        if self.path:
+            db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS docs (rowid INTEGER PRIMARY KEY, doc_id TEXT UNIQUE, metadata TEXT)")
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(terms, tokenize=\"unicode61 tokenchars '-./'\")")
+        db.commit()
+        self._db, self._pid = db, os.getpid()
+        return db
+
+    def save(self):
+        """Commit the pending adds and removes."""
+        with self._lock:
+            self._conn().commit()
+            self.dirty = False
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            return self._conn().execute("SELECT 1 FROM docs WHERE doc_id = ?", (doc_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict[str, Any]] = None):
+        """Index text under doc_id, replacing any earlier version."""
+        with self._lock:
+            db = self._conn()
+            self._delete(db, [doc_id])
+            rowid = db.execute(
+                "INSERT INTO docs (doc_id, metadata) VALUES (?, ?)", (doc_id, json.dumps(metadata or {}))
+            ).lastrowid
+            db.execute("INSERT INTO passages (rowid, terms) VALUES (?, ?)", (rowid, " ".join(tokenize(text))))
+            self.dirty = True
+
+    def remove(self, doc_ids: Iterable[str]):
+        with self._lock:
+            if self._delete(self._conn(), doc_ids):
+                self.dirty = True
+
+    @staticmethod
+    def _delete(db: sqlite3.Connection, doc_ids: Iterable[str]) -> int:
+        removed = 0
+        for doc_id in doc_ids:
+            row = db.execute("SELECT rowid FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                continue
+            db.execute("DELETE FROM passages WHERE rowid = ?", row)
+            db.execute("DELETE FROM docs WHERE rowid = ?", row)
+            removed += 1
+        return removed
+
+    def search(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
+        """Return the top_k documents by BM25 score as [{'id', 'score', 'metadata'}]."""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        # Tokens only hold [a-z0-9-./], so quoting each one makes a safe FTS5 query
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT docs.doc_id, bm25(passages), docs.metadata FROM passages JOIN docs ON docs.rowid = passages.rowid "
+                "WHERE passages MATCH ? ORDER BY bm25(passages) LIMIT ?", (match, top_k)
+            ).fetchall()
+        # FTS5 scores are negated so that larger is better, like the vector scores
+        return [{"id": doc_id, "score": -score, "metadata": json.loads(metadata)} for doc_id, score, metadata in rows]
+
+
+def reciprocal_rank_fusion(ranked_lists: Dict[str, Sequence[Dict[str, Any]]], k: int = 60,
+                           top_k: int = 10) -> List[Dict[str, Any]]:
+    """Merge ranked match lists by summing 1 / (k + rank) per document.
+
+    ranked_lists maps a source name to its matches; each fused match keeps the
+    first metadata seen and records the original score from every source.
+    """
+    fused: Dict[str, Dict[str, Any]] = {}
+    for source, matches in ranked_lists.items():
+        for rank, match in enumerate(matches, start=1):
+            entry = fused.setdefault(match["id"], {"id": match["id"], "score": 0.0,
+                                                   "metadata": match.get("metadata") or {}, "sources": {}})
+            entry["score"] += 1.0 / (k + rank)
+            entry["sources"][source] = match.get("score")
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:top_k]
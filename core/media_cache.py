@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def media_key(input_type: str, data: bytes, config: Dict[str, Any]) -> str:
+    """Hash the raw media bytes together with everything that changes how they are processed."""
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(f"{input_type}\x00{json.dumps(config, sort_keys=True)}\x00".encode("utf-8"))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """Cache the processed text of voice and video uploads by content hash.
+
+    The in-process tier is an LRU bounded by ``max_bytes`` of cached text; the
+    optional SQLite tier at ``disk_path`` survives restarts and is evicted
+    least-recently-used first past ``max_disk_bytes``.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, disk_path: Optional[str] = None,
+                 max_disk_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self._inherited = []
+        self._disk_bytes = 0
+        self._disk_writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """Return this process's connection to the disk tier, opening it on first use.
+
+        A SQLite connection must not be used across a fork, so a worker forked
+        from a process that already had one opens its own; the inherited handle
+        is kept but never touched, since closing it could disturb the parent's locks.
+        """
+        if not self.disk_path:
+            return None
+        if self._db_pid != os.getpid():
+            if self._db is not None:
+                self._inherited.append(self._db)
+            self._open_disk(self.disk_path)
+        return self._db
+
+    def _open_disk(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db_pid = os.getpid()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media_results ("
+            "key TEXT PRIMARY KEY, input_type TEXT, value TEXT, size INTEGER, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS media_results_last_used ON media_results(last_used)")
+        self._db.commit()
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM media_results").fetchone()[0]
+        logger.info(f"Opened media cache at {path} ({self._disk_bytes} bytes)")
+
+    @staticmethod
+    def _size(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8"))
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the processed text cached under ``key`` or None on a miss."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            db = self._disk()
+            if db is not None:
+                row = db.execute("SELECT value FROM media_results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE media_results SET last_used = ? WHERE key = ?", (time.time(), key))
+                    db.commit()
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str, input_type: str = ""):
+        """Store ``value`` in both tiers."""
+        with self._lock:
+            self._remember(key, value)
+            if self._disk() is not None:
+                self._write_disk(key, input_type, value)
+
+    def _remember(self, key: str, value: str):
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= self._size(key, previous)
+        self._memory[key] = value
+        self._memory_bytes += self._size(key, value)
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            old_key, old_value = self._memory.popitem(last=False)
+            self._memory_bytes -= self._size(old_key, old_value)
+
+    def _write_disk(self, key: str, input_type: str, value: str):
+        size = self._size(key, value)
+        previous = self._db.execute("SELECT size FROM media_results WHERE key = ?", (key,)).fetchone()
+        self._db.execute(
+            "INSERT OR REPLACE INTO media_results (key, input_type, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, input_type, value, size, time.time())
+        )
+        self._disk_bytes += size - (previous[0] if previous else 0)
+        self._recount_disk()
+        while self._disk_bytes > self.max_disk_bytes:
+            oldest = self._db.execute(
+                "SELECT key, size FROM media_results ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if oldest is None:
+                break
+            self._db.execute("DELETE FROM media_results WHERE key = ?", (oldest[0],))
+            self._disk_bytes -= oldest[1]
+            self.evictions += 1
+        self._db.commit()
+
+    def _recount_disk(self):
+        # Other worker processes write to the same file, so the running total is re-read now and then
+        self._disk_writes += 1
+        if self._disk_writes % 256 == 0:
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM media_results").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current tier sizes."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "disk_evictions": self.evictions,
+            }
@@ -0,0 +1,259 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; access is then only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """Cache answers by query embedding; a lookup hits when cosine similarity clears ``threshold``.
+
+    Entries live in a preallocated float32 matrix so a lookup is one matrix-vector
+    product. Entries expire after ``ttl`` seconds and the least recently used one
+    is evicted when the cache is full.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._created = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._values: List[Any] = [None] * max_entries
+        self._costs = np.zeros(max_entries, dtype=np.float64)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, now: float):
+        stale = self._valid & (now - self._created > self.ttl)
+        if stale.any():
+            self.expired += int(stale.sum())
+            self._valid &= ~stale
+            for slot in np.flatnonzero(stale):
+                self._values[slot] = None
+
+    def lookup(self, embedding: List[float]) -> Optional[Any]:
+        """Return the value stored for the most similar cached query, or None."""
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if self._matrix is None or not self._valid.any() or self._matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            scores = np.where(self._valid, self._matrix @ query, -np.inf)
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[slot] = now
+            self.hits += 1
+            self.seconds_saved += float(self._costs[slot])
+            return self._values[slot]
+
+    def store(self, embedding: List[float], value: Any, cost_seconds: float = 0.0):
+        """Cache value for this query embedding; cost_seconds is the work a future hit will skip."""
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._valid[:] = False
+            self._expire(now)
+            free = np.flatnonzero(~self._valid)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._matrix[slot] = vector
+            self._values[slot] = value
+            self._created[slot] = now
+            self._last_used[slot] = now
+            self._costs[slot] = cost_seconds
+            self._valid[slot] = True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit rate, latency saved and occupancy."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "seconds_saved": self.seconds_saved,
+                "entries": int(self._valid.sum()),
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+class SharedSemanticCache:
+    """SemanticCache whose entries live in one memory-mapped file shared by every worker process.
+
+    The file at ``<path>-<dimension>.bin`` (put it on tmpfs such as /dev/shm)
+    holds the normalized query matrix, the slot bookkeeping and each value as
+    JSON in a fixed ``value_bytes`` slot, so values must be JSON-serializable
+    and larger ones are not cached. Lookups take a shared ``flock`` on
+    ``<path>.lock`` and stores an exclusive one; hit/miss counters are per process.
+    """
+
+    def __init__(self, path: str, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 1000,
+                 value_bytes: int = 4096):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.value_bytes = value_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._lock_file = None
+        self._segments: Dict[int, Dict[str, np.ndarray]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized = 0
+        self.seconds_saved = 0.0
+
+    def _layout(self, dimension: int):
+        n = self.max_entries
+        fields = [("matrix", np.float32, (n, dimension)), ("created", np.float64, (n,)),
+                  ("last_used", np.float64, (n,)), ("costs", np.float64, (n,)),
+                  ("sizes", np.uint32, (n,)), ("valid", np.uint8, (n,)), ("values", np.uint8, (n, self.value_bytes))]
+        offset = 0
+        for name, dtype, shape in fields:
+            yield name, dtype, shape, offset
+            # Keep every array 8-byte aligned
+            offset += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8
+        yield None, None, None, offset
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._lock:
+            if self._pid != os.getpid():
+                # An inherited descriptor shares its flock with the parent, so each process opens its own;
+                # mappings made before a fork still point at the same file and stay valid
+                self._lock_file = open(f"{self.path}.lock", "a")
+                self._pid = os.getpid()
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _segment(self, dimension: int, create: bool) -> Optional[Dict[str, np.ndarray]]:
+        segment = self._segments.get(dimension)
+        if segment is not None:
+            return segment
+        layout = list(self._layout(dimension))
+        size = layout[-1][3]
+        file_path = f"{self.path}-{dimension}.bin"
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != size:
+            if not create:
+                return None
+            # Only called under the exclusive lock; a zero-filled file is an empty cache
+            tmp_path = f"{file_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.truncate(size)
+            os.replace(tmp_path, file_path)
+            logger.info(f"Created shared response cache {file_path} ({size} bytes)")
+        buffer = np.memmap(file_path, dtype=np.uint8, mode="r+", shape=(size,))
+        segment = {
+            name: buffer[offset:offset + int(np.prod(shape)) * np.dtype(dtype).itemsize].view(dtype).reshape(shape)
+            for name, dtype, shape, offset in layout[:-1]
+        }
+        self._segments[dimension] = segment
+        return segment
+
+    def lookup(self, embedding: List[float]) -> Optional[Any]:
+        """Return the value stored for the most similar cached query, or None."""
+        query = SemanticCache._normalize(embedding)
+        now = time.time()
+        with self._locked(exclusive=False):
+            segment = self._segment(query.shape[0], create=False)
+            live = None if segment is None else (segment["valid"] == 1) & (now - segment["created"] <= self.ttl)
+            if live is None or not live.any():
+                self.misses += 1
+                return None
+            scores = np.where(live, segment["matrix"] @ query, -np.inf)
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+            # A racy single-word write under the shared lock; LRU order only needs to be approximate
+            segment["last_used"][slot] = now
+            self.hits += 1
+            self.seconds_saved += float(segment["costs"][slot])
+            payload = segment["values"][slot, :int(segment["sizes"][slot])].tobytes()
+        return json.loads(payload)
+
+    def store(self, embedding: List[float], value: Any, cost_seconds: float = 0.0):
+        """Cache a JSON-serializable value for this query embedding."""
+        vector = SemanticCache._normalize(embedding)
+        payload = json.dumps(value).encode("utf-8")
+        if len(payload) > self.value_bytes:
+            self.oversized += 1
+            return
+        now = time.time()
+        with self._locked(exclusive=True):
+            segment = self._segment(vector.shape[0], create=True)
+            free = np.flatnonzero((segment["valid"] == 0) | (now - segment["created"] > self.ttl))
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(segment["last_used"]))
+                self.evictions += 1
+            segment["valid"][slot] = 0
+            segment["matrix"][slot] = vector
+            segment["values"][slot, :len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+            segment["sizes"][slot] = len(payload)
+            segment["created"][slot] = now
+            segment["last_used"][slot] = now
+            segment["costs"][slot] = cost_seconds
+            segment["valid"][slot] = 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return this process's hit rate and latency saved, and the shared occupancy."""
+        now = time.time()
+        with self._locked(exclusive=False):
+            entries = sum(
+                int(((s["valid"] == 1) & (now - s["created"] <= self.ttl)).sum()) for s in self._segments.values()
+            )
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "seconds_saved": self.seconds_saved,
+            "entries": entries,
+            "evictions": self.evictions,
+            "oversized": self.oversized,
+            "shared_path": self.path,
+        }
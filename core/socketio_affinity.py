@@ -0,0 +1,173 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Engine.IO keeps each session in the worker process that opened it, and gunicorn hands every request
+# to whichever worker accepts it. Session ids are tagged with the owner's pid; a worker that gets a
+# long-polling request for another worker's session relays it over that worker's unix socket.
+AFFINITY_DIR = os.getenv("SOCKETIO_AFFINITY_DIR", os.path.join(tempfile.gettempdir(), "ixome-socketio"))
+RELAY_TIMEOUT = float(os.getenv("SOCKETIO_RELAY_TIMEOUT", "60"))
+_FRAME = struct.Struct("!II")
+
+
+def worker_tag() -> str:
+    return f"{os.getpid():x}"
+
+
+def socket_path(tag: str) -> str:
+    return os.path.join(AFFINITY_DIR, f"worker-{tag}.sock")
+
+
+def tag_session_ids(eio):
+    """Prefix the session ids an engineio.AsyncServer generates with this process's tag."""
+    generate = eio.generate_id
+    eio.generate_id = lambda: f"{worker_tag()}.{generate()}"
+
+
+def session_owner(scope: Dict[str, Any]) -> Optional[str]:
+    sid = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("sid")
+    if not sid or "." not in sid[0]:
+        return None
+    return sid[0].split(".", 1)[0]
+
+
+async def _write_frame(writer: asyncio.StreamWriter, meta: Dict[str, Any], body: bytes):
+    header = json.dumps(meta).encode("utf-8")
+    writer.write(_FRAME.pack(len(header), len(body)) + header + body)
+    await writer.drain()
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    header_size, body_size = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    meta = json.loads(await reader.readexactly(header_size))
+    return meta, await reader.readexactly(body_size)
+
+
+def _latin1(pairs):
+    return [[key.decode("latin-1"), value.decode("latin-1")] for key, value in pairs]
+
+
+class AffinityMiddleware:
+    """ASGI middleware that sends Engine.IO requests to the worker owning their session.
+
+    Long-polling requests for another worker's session are relayed to it and
+    its response is returned. A websocket upgrade for another worker's session
+    is refused; the client then keeps polling, which is relayed. New
+    connections and everything outside ``path`` go to ``app`` unchanged.
+    """
+
+    def __init__(self, app, path: str = "/socket.io"):
+        self.app = app
+        self.path = path
+        self.relayed = 0
+        self.refused_upgrades = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket") and scope["path"].startswith(self.path):
+            owner = session_owner(scope)
+            if owner is not None and owner != worker_tag():
+                if scope["type"] == "websocket":
+                    self.refused_upgrades += 1
+                    await receive()  # websocket.connect
+                    await send({"type": "websocket.close", "code": 1013})
+                    return
+                if await self._relay(owner, scope, receive, send):
+                    return
+        await self.app(scope, receive, send)
+
+    async def _relay(self, owner: str, scope, receive, send) -> bool:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path(owner))
+        except OSError as e:
+            # The owner is gone (e.g. restarted); the local app answers with an invalid-session error
+            logger.warning(f"Cannot relay Socket.IO request to worker {owner}: {e}")
+            replay = [{"type": "http.request", "body": body, "more_body": False}]
+
+            async def receive_again():
+                return replay.pop() if replay else await receive()
+            await self.app(scope, receive_again, send)
+            return True
+        try:
+            meta = {"method": scope["method"], "path": scope["path"],
+                    "query_string": scope.get("query_string", b"").decode("latin-1"),
+                    "headers": _latin1(scope.get("headers", [])), "client": scope.get("client")}
+            await _write_frame(writer, meta, body)
+            response, response_body = await asyncio.wait_for(_read_frame(reader), RELAY_TIMEOUT)
+        finally:
+            writer.close()
+        self.relayed += 1
+        await send({"type": "http.response.start", "status": response["status"],
+                    "headers": [(key.encode("latin-1"), value.encode("latin-1")) for key, value in response["headers"]]})
+        await send({"type": "http.response.body", "body": response_body})
+        return True
+
+
+async def start_relay_server(app) -> asyncio.AbstractServer:
+    """Serve requests relayed by other workers for sessions this worker owns, on its unix socket."""
+    os.makedirs(AFFINITY_DIR, exist_ok=True)
+    path = socket_path(worker_tag())
+    if os.path.exists(path):
+        os.unlink(path)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            meta, body = await _read_frame(reader)
+            scope = {
+                "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+                "method": meta["method"], "path": meta["path"], "raw_path": meta["path"].encode("latin-1"),
+                "root_path": "", "query_string": meta["query_string"].encode("latin-1"),
+                "headers": [(key.encode("latin-1"), value.encode("latin-1")) for key, value in meta["headers"]],
+                "client": tuple(meta["client"]) if meta.get("client") else None, "server": None,
+            }
+            pending = [{"type": "http.request", "body": body, "more_body": False}]
+            done = asyncio.Event()
+            response: Dict[str, Any] = {"status": 500, "headers": []}
+            chunks = []
+
+            async def receive():
+                if pending:
+                    return pending.pop()
+                await done.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = _latin1(message.get("headers", []))
+                elif message["type"] == "http.response.body":
+                    chunks.append(message.get("body", b""))
+
+            try:
+                await app(scope, receive, send)
+            finally:
+                done.set()
+            await _write_frame(writer, response, b"".join(chunks))
+        except Exception as e:
+            logger.error(f"Relayed Socket.IO request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_unix_server(handle, path=path)
+    logger.info(f"Socket.IO relay for worker {worker_tag()} listening on {path}")
+    return server
+
+
+async def stop_relay_server(server: asyncio.AbstractServer):
+    server.close()
+    await server.wait_closed()
+    path = socket_path(worker_tag())
+    if os.path.exists(path):
+        os.unlink(path)
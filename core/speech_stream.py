@@ -0,0 +1,139 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from core.executors import stage_executor
+
+logger = logging.getLogger(__name__)
+
+# streaming_recognize rejects requests whose audio_content is larger than 25 KB
+STREAM_CHUNK_BYTES = 25 * 1024
+# Interim results at or above this stability are unlikely to change
+STABILITY_THRESHOLD = 0.8
+
+
+class VoiceStream:
+    """Transcribe audio with Google streaming recognition while it is still being uploaded.
+
+    ``feed`` queues chunks as they arrive and never waits on the network;
+    recognition runs on the ``speech_stream`` executor stage. For every interim
+    response ``on_partial(transcript, stable_transcript)`` is called from the
+    worker thread, where ``stable_transcript`` covers the final results plus the
+    interim ones at or above ``stability_threshold``. ``on_stable`` fires once,
+    with the first non-empty stable transcript.
+    """
+
+    def __init__(self, client, sample_rate_hertz: int = 16000, language_code: str = "en-US",
+                 encoding: str = "LINEAR16", on_partial: Optional[Callable[[str, str], None]] = None,
+                 on_stable: Optional[Callable[[str], None]] = None,
+                 stability_threshold: float = STABILITY_THRESHOLD):
+        self.client = client
+        self.sample_rate_hertz = sample_rate_hertz
+        self.language_code = language_code
+        self.encoding = encoding
+        self.on_partial = on_partial
+        self.on_stable = on_stable
+        self.stability_threshold = stability_threshold
+        self.bytes_received = 0
+        self.first_partial_seconds: Optional[float] = None
+        self.first_stable_seconds: Optional[float] = None
+        self.error: Optional[Exception] = None
+        self._final: List[str] = []
+        self._chunks: queue.Queue = queue.Queue()
+        self._closed = threading.Event()
+        self._started = time.perf_counter()
+        self.future = stage_executor("speech_stream").submit(self._run)
+
+    @property
+    def transcript(self) -> str:
+        """Concatenated final results received so far."""
+        return " ".join(self._final)
+
+    def feed(self, chunk: bytes):
+        if self._closed.is_set():
+            raise RuntimeError("Voice stream is already closed")
+        self.bytes_received += len(chunk)
+        for i in range(0, len(chunk), STREAM_CHUNK_BYTES):
+            self._chunks.put(chunk[i:i + STREAM_CHUNK_BYTES])
+
+    def close(self):
+        """Signal the end of the audio; the recognizer flushes its final results."""
+        if not self._closed.is_set():
+            self._closed.set()
+            self._chunks.put(None)
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        """Close the stream and block until the final transcript is available."""
+        self.close()
+        return self.future.result(timeout)
+
+    def _requests(self):
+        from google.cloud import speech
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=chunk)
+
+    def _run(self) -> str:
+        from google.cloud import speech
+        config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding[self.encoding],
+                sample_rate_hertz=self.sample_rate_hertz,
+                language_code=self.language_code
+            ),
+            interim_results=True
+        )
+        try:
+            for response in self.client.streaming_recognize(config=config, requests=self._requests()):
+                self._handle(response)
+        except Exception as e:
+            logger.error(f"Streaming recognition failed after {self.bytes_received} bytes: {e}")
+            self.error = e
+            # Unblock the producer side; later chunks are dropped
+            self._closed.set()
+            if not self._final:
+                raise
+        logger.info(f"Streaming recognition finished: {self.bytes_received} bytes, "
+                    f"first stable partial after {self.first_stable_seconds}s")
+        return self.transcript
+
+    def _handle(self, response):
+        interim: List[str] = []
+        stable: List[str] = []
+        still_stable = True
+        for result in response.results:
+            if not result.alternatives:
+                continue
+            text = result.alternatives[0].transcript.strip()
+            if result.is_final:
+                self._final.append(text)
+                continue
+            interim.append(text)
+            # Only a stable prefix counts; Google orders interim results from most to least stable
+            still_stable = still_stable and result.stability >= self.stability_threshold
+            if still_stable:
+                stable.append(text)
+        partial = " ".join(self._final + interim)
+        stable_partial = " ".join(self._final + stable)
+        if not partial:
+            return
+        elapsed = round(time.perf_counter() - self._started, 3)
+        if self.first_partial_seconds is None:
+            self.first_partial_seconds = elapsed
+        if self.on_partial:
+            self._callback(self.on_partial, partial, stable_partial)
+        if stable_partial and self.first_stable_seconds is None:
+            self.first_stable_seconds = elapsed
+            if self.on_stable:
+                self._callback(self.on_stable, stable_partial)
+
+    @staticmethod
+    def _callback(callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Voice stream callback failed: {e}")
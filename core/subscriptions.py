@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionService:
+    """Strapi subscription lookups with a per-user TTL cache.
+
+    A user record is fetched at most once per ``ttl`` seconds. Concurrent
+    lookups for the same user share one in-flight request (single-flight), and
+    token changes made through this service update the cached record instead
+    of forcing another GET. ``invalidate`` drops a user whose subscription was
+    changed elsewhere, e.g. by a payment webhook.
+
+    With a ``ledger`` (core.token_ledger.TokenLedger), consuming a token is a
+    local write and the ledger updates Strapi in the background through
+    ``read_tokens`` and ``write_tokens``; the effective balance is Strapi's count minus what
+    is still pending in the ledger.
+    """
+
+    def __init__(self, strapi_url: str, token: str, ttl: float = 60.0, timeout: float = 5.0,
+                 session: Optional[requests.Session] = None, ledger=None):
+        self.strapi_url = strapi_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.ledger = ledger
+        self._lock = threading.Lock()
+        # user_id -> (monotonic time cached, wall time the fetch started, record)
+        self._cache: Dict[str, Tuple[float, float, Optional[Dict[str, Any]]]] = {}
+        self._in_flight: Dict[str, Tuple[float, Future]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.requests = 0
+
+    def _fetch(self, user_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self.requests += 1
+        response = self.session.get(
+            f"{self.strapi_url}/api/users", params={"filters[username][$eq]": user_id},
+            headers=self.headers, timeout=self.timeout
+        )
+        response.raise_for_status()
+        users = response.json().get("data") or []
+        return users[0] if users else None
+
+    def get_user(self, user_id: str, fetched_after: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Return the Strapi user record (None if there is no such user), from cache when fresh.
+
+        A cached record, or an in-flight fetch, that started before the wall
+        time ``fetched_after`` is not used.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached is not None and now - cached[0] < self.ttl and cached[1] >= fetched_after:
+                self.hits += 1
+                return cached[2]
+            flight = self._in_flight.get(user_id)
+            leader = flight is None or flight[0] < fetched_after
+            if leader:
+                flight = (time.time(), Future())
+                self._in_flight[user_id] = flight
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        started, future = flight
+        if not leader:
+            return future.result(self.timeout * 2)
+        try:
+            user = self._fetch(user_id)
+            with self._lock:
+                cached = self._cache.get(user_id)
+                if cached is None or cached[1] <= started:
+                    self._cache[user_id] = (time.monotonic(), started, user)
+            future.set_result(user)
+            return user
+        except Exception as e:
+            # Failures are not cached; every waiter sees this one
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._in_flight.get(user_id) is flight:
+                    del self._in_flight[user_id]
+
+    @staticmethod
+    def tokens(user: Optional[Dict[str, Any]]) -> int:
+        return int(((user or {}).get("attributes", {}).get("subscription") or {}).get("tokens", 0) or 0)
+
+    def _balance(self, user_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """Return the user record and the effective tokens left.
+
+        The ledger is read before the record: a record fetched before the
+        user's last flush (by any worker) is fetched again, since its count
+        does not include the tokens that flush removed from the pending count.
+        """
+        pending, flushed_at = self.ledger.state(user_id) if self.ledger else (0, 0.0)
+        user = self.get_user(user_id, fetched_after=flushed_at)
+        return user, self.tokens(user) - pending
+
+    def tokens_left(self, user_id: str) -> int:
+        """Strapi's token count minus consumption not flushed to Strapi yet."""
+        return self._balance(user_id)[1]
+
+    def is_entitled(self, user_id: str) -> bool:
+        """True if the user has tokens left or has not used their free first visit."""
+        user, left = self._balance(user_id)
+        if not user:
+            return False
+        return left > 0 or not user.get("attributes", {}).get("first_visit_done", False)
+
+    def consume_token(self, user_id: str) -> Optional[int]:
+        """Use one of the user's tokens.
+
+        With a ledger this is only a local write and returns None; otherwise
+        Strapi is updated synchronously and the count left is returned.
+        """
+        if self.ledger is not None:
+            self.ledger.record(user_id)
+            return None
+        user = self.get_user(user_id)
+        remaining = self.tokens(user) - 1
+        with self._lock:
+            self.requests += 1
+        try:
+            response = self.session.put(
+                f"{self.strapi_url}/api/users/{user_id}", json={"tokens": remaining},
+                headers=self.headers, timeout=self.timeout
+            )
+            response.raise_for_status()
+        except Exception:
+            self.invalidate(user_id)
+            raise
+        with self._lock:
+            if user is not None:
+                attributes = user.setdefault("attributes", {})
+                attributes["subscription"] = dict(attributes.get("subscription") or {}, tokens=remaining)
+                self._cache[user_id] = (time.monotonic(), time.time(), user)
+        return remaining
+
+    def read_tokens(self, user_id: str) -> Optional[int]:
+        """Return the user's token count as stored in Strapi right now (None if unknown); used by the ledger flusher."""
+        user = self._fetch(user_id)
+        return None if user is None else self.tokens(user)
+
+    def write_tokens(self, user_id: str, tokens: int):
+        """Set the user's token count in Strapi; used by the ledger flusher."""
+        with self._lock:
+            self.requests += 1
+        try:
+            response = self.session.put(
+                f"{self.strapi_url}/api/users/{user_id}", json={"tokens": tokens},
+                headers=self.headers, timeout=self.timeout
+            )
+            response.raise_for_status()
+        finally:
+            # The next lookup must see the new count, since the ledger is about to drop these tokens
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Forget one user's cached record, or every user's when user_id is None."""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "strapi_requests": self.requests,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                "cached_users": len(self._cache),
+            }
+
+
+def subscriptions_from_env(session=None) -> SubscriptionService:
+    """Build the service and its token ledger from STRAPI_* and TOKEN_* settings, and start the flusher.
+
+    Call this in each worker process: the flusher is a thread and does not survive a fork.
+    """
+    from core.token_ledger import TokenLedger
+    ledger = TokenLedger(
+        os.environ.get('TOKEN_LEDGER_PATH', os.path.join(os.path.dirname(__file__), '..', 'data', 'token_ledger.db')),
+        interval=float(os.environ.get('TOKEN_FLUSH_INTERVAL', '5'))
+    )
+    service = SubscriptionService(
+        os.environ.get('STRAPI_URL', 'http://localhost:1337'), os.environ.get('STRAPI_TOKEN', 'your_strapi_jwt'),
+        ttl=float(os.environ.get('SUBSCRIPTION_CACHE_TTL', '60')), session=session, ledger=ledger
+    )
+    ledger.start(service.read_tokens, service.write_tokens)
+    return service
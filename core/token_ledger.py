@@ -0,0 +1,198 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; flushes are then only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class TokenLedger:
+    """Write-behind record of consumed subscription tokens.
+
+    ``record`` adds to a per-user counter in a SQLite (WAL) file with a single
+    atomic upsert, so a chat reply never waits on Strapi and concurrent
+    sessions and workers cannot lose each other's decrements. Every
+    ``interval`` seconds a background thread applies each user's accumulated
+    count to their stored balance; anything recorded meanwhile stays pending.
+    An exclusive lock file makes sure only one process flushes at a time.
+
+    Flushes are idempotent. The count is first moved to an ``in_flight`` row;
+    the balance read and the target balance are saved there before the
+    target is written, and the row is only dropped once the write succeeded.
+    A flush interrupted at any point (a crash, or an error after the write
+    landed) is finished on the next round by comparing the stored balance
+    with the saved base and target, so tokens are never charged twice.
+
+    Each flush also stamps the user's ``flushed_at`` time, so every process
+    can tell that a Strapi record it fetched before then no longer matches
+    the pending count (see ``state``).
+    """
+
+    def __init__(self, path: str, interval: float = 5.0):
+        self.path = path
+        self.interval = interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        db = self._db()
+        db.execute("CREATE TABLE IF NOT EXISTS pending (user_id TEXT PRIMARY KEY, consumed INTEGER, updated REAL)")
+        db.execute("CREATE TABLE IF NOT EXISTS flushes (user_id TEXT PRIMARY KEY, flushed_at REAL)")
+        db.execute("CREATE TABLE IF NOT EXISTS in_flight (user_id TEXT PRIMARY KEY, consumed INTEGER, base INTEGER, target INTEGER)")
+        db.commit()
+        self._read_balance: Optional[Callable[[str], Optional[int]]] = None
+        self._write_balance: Optional[Callable[[str, int], None]] = None
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushed_tokens = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets request threads write while the flusher reads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def record(self, user_id: str, tokens: int = 1):
+        """Add tokens to the user's pending consumption."""
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT INTO pending (user_id, consumed, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET consumed = consumed + excluded.consumed, updated = excluded.updated",
+                (user_id, tokens, time.time())
+            )
+
+    def pending(self, user_id: str) -> int:
+        """Tokens consumed by the user that Strapi does not know about yet."""
+        return self.state(user_id)[0]
+
+    def state(self, user_id: str) -> Tuple[int, float]:
+        """Return (pending tokens, wall time of the user's last flush or 0.0) in one read.
+
+        A Strapi count fetched before ``flushed_at`` may predate that flush and
+        must be fetched again before the pending count is subtracted from it.
+        """
+        row = self._db().execute(
+            "SELECT (SELECT consumed FROM pending WHERE user_id = ?), (SELECT consumed FROM in_flight WHERE user_id = ?), "
+            "(SELECT flushed_at FROM flushes WHERE user_id = ?)",
+            (user_id, user_id, user_id)
+        ).fetchone()
+        return (row[0] or 0) + (row[1] or 0), row[2] or 0.0
+
+    def start(self, read_balance: Callable[[str], Optional[int]], write_balance: Callable[[str, int], None]):
+        """Start the background flusher.
+
+        read_balance(user_id) returns the user's stored token count (None for an
+        unknown user) and write_balance(user_id, tokens) stores a new count;
+        both raise on failure.
+        """
+        self._read_balance = read_balance
+        self._write_balance = write_balance
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-ledger-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, flush: bool = True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+        if flush and self._write_balance is not None:
+            self.flush_now()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush_now()
+
+    def flush_now(self) -> int:
+        """Flush every pending count once; returns the number of tokens applied."""
+        if self._write_balance is None:
+            return 0
+        with self._flush_lock, open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0  # Another worker is flushing
+            started = time.perf_counter()
+            db = self._db()
+            applied = 0
+            users = db.execute(
+                "SELECT user_id FROM pending WHERE consumed > 0 UNION SELECT user_id FROM in_flight"
+            ).fetchall()
+            for (user_id,) in users:
+                try:
+                    applied += self._flush_user(db, user_id)
+                except Exception as e:
+                    self.flush_errors += 1
+                    logger.error(f"Could not flush tokens for {user_id}; will retry: {e}")
+            self.flushed_tokens += applied
+            self.last_flush_seconds = time.perf_counter() - started
+            if applied:
+                logger.info(f"Flushed {applied} consumed tokens to Strapi in {self.last_flush_seconds:.2f}s")
+            return applied
+
+    def _flush_user(self, db: sqlite3.Connection, user_id: str) -> int:
+        """Apply one user's in-flight count (claiming their pending count first if there is none)."""
+        with db:
+            row = db.execute("SELECT consumed, base, target FROM in_flight WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                db.execute(
+                    "INSERT INTO in_flight (user_id, consumed) SELECT user_id, consumed FROM pending "
+                    "WHERE user_id = ? AND consumed > 0", (user_id,)
+                )
+                db.execute("DELETE FROM pending WHERE user_id = ?", (user_id,))
+                row = db.execute("SELECT consumed, base, target FROM in_flight WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return 0
+        consumed, base, target = row
+        balance = self._read_balance(user_id)
+        if balance is None:
+            logger.warning(f"Dropping {consumed} consumed tokens for unknown user {user_id}")
+        elif target is None or balance == base:
+            # Not written yet: save the plan first, so a retry can tell whether the write landed
+            if target is None:
+                base, target = balance, balance - consumed
+                with db:
+                    db.execute("UPDATE in_flight SET base = ?, target = ? WHERE user_id = ?", (base, target, user_id))
+            self._write_balance(user_id, target)
+        elif balance != target:
+            # Changed elsewhere since the interrupted write; re-applying could charge these tokens twice
+            logger.warning(f"Balance of {user_id} is {balance}, neither {base} nor {target}; "
+                           f"assuming the interrupted flush of {consumed} tokens was applied")
+        with db:
+            db.execute("DELETE FROM in_flight WHERE user_id = ?", (user_id,))
+            db.execute(
+                "INSERT INTO flushes (user_id, flushed_at) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET flushed_at = excluded.flushed_at",
+                (user_id, time.time())
+            )
+        return consumed
+
+    def stats(self) -> Dict[str, Any]:
+        users, tokens = self._db().execute(
+            "SELECT COUNT(DISTINCT user_id), COALESCE(SUM(consumed), 0) FROM "
+            "(SELECT user_id, consumed FROM pending UNION ALL SELECT user_id, consumed FROM in_flight)"
+        ).fetchone()
+        return {
+            "pending_users": users,
+            "pending_tokens": tokens,
+            "flushed_tokens": self.flushed_tokens,
+            "flush_errors": self.flush_errors,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Queries and indexed passages must come from the same model: load_to_pinecone.py embeds
+# passages and ChatAgent embeds queries with these, and indexes are created with this dimension
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSION = 3072
+
+
+class LocalIndex:
+    """In-process cosine index exposing the subset of the Pinecone ``Index`` API we use.
+
+    Rows are L2-normalized float32 vectors kept in ``<path>.npy`` and opened as a
+    read-only memory map; ids and metadata live next to it in ``<path>.json``.
+    The first write copies the rows into an in-memory buffer that grows by
+    doubling, so a long run of upserts is linear in the number of vectors;
+    writes are persisted with ``save()``.
+    """
+
+    def __init__(self, path: str, dimension: Optional[int] = None, autosave: bool = True):
+        self.path = path
+        self.dimension = dimension
+        self.autosave = autosave
+        self._lock = threading.Lock()
+        self._buffer = np.zeros((0, dimension or 0), dtype=np.float32)
+        self._count = 0
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+        self._load()
+
+    @property
+    def _matrix(self) -> np.ndarray:
+        """The rows in use; a view, so concurrent queries see row updates made in place."""
+        return self._buffer[:self._count]
+
+    def _reserve(self, rows: int):
+        """Make the buffer writable with room for at least ``rows`` rows."""
+        capacity = self._buffer.shape[0]
+        if self._buffer.flags.writeable and capacity >= rows and self._buffer.shape[1] == self.dimension:
+            return
+        buffer = np.empty((max(rows, 2 * capacity, 64), self.dimension), dtype=np.float32)
+        if self._count:
+            buffer[:self._count] = self._buffer[:self._count]
+        self._buffer = buffer
+
+    @property
+    def matrix_path(self) -> str:
+        return f"{self.path}.npy"
+
+    @property
+    def meta_path(self) -> str:
+        return f"{self.path}.json"
+
+    def _load(self):
+        if not (os.path.exists(self.matrix_path) and os.path.exists(self.meta_path)):
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self._buffer = np.load(self.matrix_path, mmap_mode='r')
+        self._count = self._buffer.shape[0]
+        self._ids = meta['ids']
+        self._metadata = meta['metadata']
+        self._positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+        if self._matrix.shape[0]:
+            if self.dimension and self.dimension != self._matrix.shape[1]:
+                logger.warning(f"Local index {self.path} has dimension {self._matrix.shape[1]}, expected {self.dimension}")
+            self.dimension = self._matrix.shape[1]
+        logger.info(f"Loaded local index {self.path} with {len(self._ids)} vectors")
+
+    def save(self):
+        """Persist the index atomically so concurrent readers never see a partial file."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            matrix, ids, metadata = self._matrix, list(self._ids), list(self._metadata)
+        tmp_matrix = f"{self.matrix_path}.tmp"
+        tmp_meta = f"{self.meta_path}.tmp"
+        with open(tmp_matrix, 'wb') as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({'ids': ids, 'metadata': metadata}, f, ensure_ascii=False)
+        os.replace(tmp_matrix, self.matrix_path)
+        os.replace(tmp_meta, self.meta_path)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, vectors: Iterable[Any], namespace: Optional[str] = None, **kwargs) -> Dict[str, int]:
+        """Insert or replace vectors given as dicts or ``(id, values[, metadata])`` tuples."""
+        ids, values, metadata = [], [], []
+        for vector in vectors:
+            if isinstance(vector, dict):
+                ids.append(str(vector['id']))
+                values.append(vector['values'])
+                metadata.append(vector.get('metadata') or {})
+            else:
+                ids.append(str(vector[0]))
+                values.append(vector[1])
+                metadata.append(vector[2] if len(vector) > 2 else {})
+        if not ids:
+            return {'upserted_count': 0}
+        rows = self._normalize(np.asarray(values, dtype=np.float32))
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = rows.shape[1]
+            if rows.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {rows.shape[1]} does not match index dimension {self.dimension}")
+            self._reserve(self._count + len(ids))
+            for vector_id, row, meta in zip(ids, rows, metadata):
+                position = self._positions.get(vector_id)
+                if position is None:
+                    position = self._positions[vector_id] = self._count
+                    self._ids.append(vector_id)
+                    self._metadata.append(meta)
+                    self._count += 1
+                else:
+                    self._metadata[position] = meta
+                self._buffer[position] = row
+        if self.autosave:
+            self.save()
+        return {'upserted_count': len(ids)}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False,
+               namespace: Optional[str] = None, **kwargs) -> Dict:
+        """Remove vectors by id, or everything with ``delete_all=True``."""
+        with self._lock:
+            if not self._count or self.dimension is None:
+                return {}
+            if delete_all:
+                keep = []
+            else:
+                drop = {self._positions[i] for i in (ids or []) if i in self._positions}
+                if not drop:
+                    return {}
+                keep = [i for i in range(len(self._ids)) if i not in drop]
+            self._buffer = np.array(self._matrix[keep], dtype=np.float32).reshape(-1, self.dimension)
+            self._count = self._buffer.shape[0]
+            self._ids = [self._ids[i] for i in keep]
+            self._metadata = [self._metadata[i] for i in keep]
+            self._positions = {vector_id: i for i, vector_id in enumerate(self._ids)}
+        if self.autosave:
+            self.save()
+        return {}
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Return stored values and metadata for the given ids."""
+        with self._lock:
+            found = {}
+            for vector_id in ids:
+                position = self._positions.get(vector_id)
+                if position is not None:
+                    found[vector_id] = {
+                        'id': vector_id,
+                        'values': self._matrix[position].tolist(),
+                        'metadata': self._metadata[position]
+                    }
+        return {'vectors': found, 'namespace': namespace or ''}
+
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = False,
+              include_values: bool = False, filter: Optional[Dict[str, Any]] = None,
+              namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Return the ``top_k`` most cosine-similar vectors, best first."""
+        with self._lock:
+            matrix, ids, metadata = self._matrix, self._ids, self._metadata
+        if not matrix.shape[0]:
+            return {'matches': [], 'namespace': namespace or ''}
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        if query.shape[0] != matrix.shape[1]:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {matrix.shape[1]}")
+        scores = matrix @ query
+        if filter:
+            allowed = np.array([self._matches_filter(meta, filter) for meta in metadata[:matrix.shape[0]]], dtype=bool)
+            scores = np.where(allowed, scores, -np.inf)
+        k = min(top_k, matrix.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        matches = []
+        for position in top:
+            if not np.isfinite(scores[position]):
+                continue
+            match = {'id': ids[position], 'score': float(scores[position])}
+            if include_metadata:
+                match['metadata'] = metadata[position]
+            if include_values:
+                match['values'] = matrix[position].tolist()
+            matches.append(match)
+        return {'matches': matches, 'namespace': namespace or ''}
+
+    @staticmethod
+    def _matches_filter(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+        for key, condition in filter.items():
+            if isinstance(condition, dict):
+                if '$eq' in condition and metadata.get(key) != condition['$eq']:
+                    return False
+                if '$in' in condition and metadata.get(key) not in condition['$in']:
+                    return False
+            elif metadata.get(key) != condition:
+                return False
+        return True
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        return {'dimension': self.dimension, 'total_vector_count': len(self._ids), 'namespaces': {}}
+
+
+def open_index(backend: str, name: str, dimension: int, pinecone_client=None,
+               local_path: Optional[str] = None, region: str = "us-east-1"):
+    """Return a local or Pinecone index object for ``name`` depending on ``backend``."""
+    if backend == "local":
+        return LocalIndex(local_path or name, dimension=dimension)
+    if backend != "pinecone":
+        raise ValueError(f"Unknown vector backend: {backend}")
+    if name not in pinecone_client.list_indexes().names():
+        pinecone_client.create_index(
+            name=name,
+            dimension=dimension,
+            metric='cosine',
+            spec={'serverless': {'cloud': 'aws', 'region': region}}
+        )
+    return pinecone_client.Index(name)
@@ -0,0 +1,130 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FRAME_STRATEGIES = ("stride", "scene", "budget")
+SHM_DIR = "/dev/shm"
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+@contextmanager
+def open_video_bytes(data: bytes, suffix: str = ".mp4"):
+    """Open an uploaded video with cv2.VideoCapture without a shared file in the working directory.
+
+    The bytes go into an anonymous memfd where the platform has one (Linux),
+    otherwise into a private temp file on tmpfs when available. Every call
+    gets its own file, so concurrent uploads cannot overwrite each other, and
+    the file is gone once the block exits.
+    """
+    capture = None
+    fd, path, unlink = None, None, False
+    try:
+        if hasattr(os, "memfd_create"):
+            fd = os.memfd_create("chat-agent-video", os.MFD_CLOEXEC)
+            _write_all(fd, data)
+            path = f"/proc/self/fd/{fd}"
+            capture = cv2.VideoCapture(path)
+            if not capture.isOpened():
+                logger.warning("Decoder could not open memfd video; falling back to a temp file")
+                capture.release()
+                os.close(fd)
+                capture, fd = None, None
+        if capture is None:
+            directory = SHM_DIR if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK) else None
+            fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+            unlink = True
+            _write_all(fd, data)
+            capture = cv2.VideoCapture(path)
+        yield capture
+    finally:
+        if capture is not None:
+            capture.release()
+        if fd is not None:
+            os.close(fd)
+        if unlink and path:
+            os.remove(path)
+
+
+def color_histogram(frame: np.ndarray, levels: int = 8, step: int = 4) -> np.ndarray:
+    """Return a normalized joint color histogram of a subsampled BGR frame."""
+    pixels = frame[::step, ::step].reshape(-1, frame.shape[-1] if frame.ndim == 3 else 1)
+    quantized = (pixels.astype(np.uint16) * levels) >> 8
+    codes = np.zeros(len(quantized), dtype=np.int64)
+    for channel in range(quantized.shape[1]):
+        codes = codes * levels + quantized[:, channel]
+    histogram = np.bincount(codes, minlength=levels ** quantized.shape[1]).astype(np.float32)
+    return histogram / max(histogram.sum(), 1.0)
+
+
+def scene_change_score(previous: np.ndarray, current: np.ndarray) -> float:
+    """Total variation distance between two normalized histograms (0 = identical, 1 = disjoint)."""
+    return float(0.5 * np.abs(previous - current).sum())
+
+
+def sample_frames(capture, strategy: str = "scene", stride: int = 15, max_frames: int = 3,
+                  scene_threshold: float = 0.3) -> Iterator[Tuple[float, np.ndarray]]:
+    """Yield (timestamp_ms, frame) for the frames worth annotating.
+
+    - ``stride``: every ``stride``-th frame.
+    - ``scene``: every ``stride``-th frame whose color histogram differs from the
+      last kept frame by at least ``scene_threshold``; the first frame is always kept.
+    - ``budget``: ``max_frames`` frames spread evenly over the clip.
+
+    Skipped frames are only grabbed, not retrieved, and decoding stops as soon
+    as ``max_frames`` frames have been yielded.
+    """
+    if strategy not in FRAME_STRATEGIES:
+        raise ValueError(f"Unknown frame strategy {strategy!r}; expected one of {FRAME_STRATEGIES}")
+    stride = max(1, stride)
+    if strategy == "budget":
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if total > 0:
+            stride = max(1, total // max(1, max_frames))
+        else:
+            logger.warning("Frame count unavailable; falling back to stride sampling")
+
+    kept = 0
+    position = 0
+    last_histogram: Optional[np.ndarray] = None
+    while kept < max_frames:
+        if not capture.grab():
+            break
+        position += 1
+        if (position - 1) % stride:
+            continue
+        ok, frame = capture.retrieve()
+        if not ok:
+            break
+        if strategy == "scene":
+            histogram = color_histogram(frame)
+            if last_histogram is not None and scene_change_score(last_histogram, histogram) < scene_threshold:
+                continue
+            last_histogram = histogram
+        kept += 1
+        yield capture.get(cv2.CAP_PROP_POS_MSEC), frame
+
+
+def extract_keyframes(data: bytes, strategy: str = "scene", stride: int = 15, max_frames: int = 3,
+                      scene_threshold: float = 0.3) -> List[Tuple[float, bytes]]:
+    """Decode an uploaded video and return (timestamp_ms, JPEG bytes) for its keyframes.
+
+    Module-level and picklable so it can run in a worker process.
+    """
+    with open_video_bytes(data) as capture:
+        return [
+            (timestamp, cv2.imencode('.jpg', frame)[1].tobytes())
+            for timestamp, frame in sample_frames(capture, strategy, stride, max_frames, scene_threshold)
+        ]
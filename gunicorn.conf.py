@@ -0,0 +1,43 @@
+import gc
+import multiprocessing
+import os
+
+# Pre-fork serving of core.fast_API:asgi_app: gunicorn -c gunicorn.conf.py core.fast_API:asgi_app
+#
+# The master imports the app and loads the read-only indexes once (preload_app + when_ready), then
+# forks WEB_CONCURRENCY workers that share those pages. Each worker builds its own ChatAgent, HTTP
+# pools and token-ledger flusher in the ASGI lifespan. Caches that workers write to live in files
+# they all open: SQLite (WAL) for embeddings and processed media, and a memory-mapped file on
+# tmpfs for semantic responses.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else DATA_DIR
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count())))
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Shared cache locations, set before the app is imported; explicit settings win
+os.makedirs(DATA_DIR, exist_ok=True)
+os.environ.setdefault('EMBEDDING_CACHE_PATH', os.path.join(DATA_DIR, 'embedding_cache.db'))
+os.environ.setdefault('MEDIA_CACHE_PATH', os.path.join(DATA_DIR, 'media_cache.db'))
+os.environ.setdefault('RESPONSE_CACHE_PATH', os.path.join(SHM_DIR, 'ixome-response-cache'))
+# The disk tier is shared, so each worker only needs a small in-process LRU in front of it
+os.environ.setdefault('EMBEDDING_CACHE_SIZE', '2000')
+os.environ.setdefault('MEDIA_CACHE_MAX_BYTES', str(4 * 1024 * 1024))
+if workers > 1:
+    # Requests of one long-polling Socket.IO session land on any worker; relay them to the session's owner
+    os.environ.setdefault('SOCKETIO_AFFINITY', '1')
+
+
+def when_ready(server):
+    from agents.chat_agent import preload_shared_state
+    preload_shared_state()
+    # Move everything loaded so far out of the collector's reach, so garbage collections in the
+    # workers do not write to (and so copy) the pages holding the preloaded objects
+    gc.freeze()
+    server.log.info(f"Shared state preloaded; starting {workers} workers")
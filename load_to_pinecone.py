@@ -1,10 +1,21 @@
+import argparse
+import glob
 import json
 import os
 import logging
+import time
 import uuid
+import hashlib
+import random
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pinecone import Pinecone, ServerlessSpec
-from openai import OpenAI
+from openai import APIConnectionError, BadRequestError, InternalServerError, OpenAI, RateLimitError
 from dotenv import load_dotenv
+from core.vector_store import EMBEDDING_DIMENSION, EMBEDDING_MODEL, LocalIndex
+from core.chunking import chunk_text
+from core.lexical_index import LexicalIndex
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -16,99 +27,457 @@ PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
 PINECONE_ENVIRONMENT = os.getenv('PINECONE_ENVIRONMENT')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Initialize Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
+# Embedding and upsert batching
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', '4'))
+# Rate-limited and transient embedding failures are retried with exponential backoff, then abort the run
+EMBED_RETRIES = int(os.getenv('EMBED_RETRIES', '5'))
+EMBED_BACKOFF_SECONDS = float(os.getenv('EMBED_BACKOFF_SECONDS', '1'))
+UPSERT_BATCH_SIZE = int(os.getenv('UPSERT_BATCH_SIZE', '100'))
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '256'))
+CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '32'))
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '5'))
+LUTRON_DATA_PATH = os.getenv('LUTRON_DATA_PATH', '/home/vincent/ixome/scrapy-selenium/lutron_scraper/lutron_data.json')
+# Every scraper output file is indexed: the JSON-lines corpus and batch exports such as lutron_data_batch1.json
+LUTRON_DATA_GLOB = os.getenv('LUTRON_DATA_GLOB', os.path.join(os.path.dirname(LUTRON_DATA_PATH), 'lutron_data*.json'))
+
 index_name = 'troubleshooter-index'
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'pinecone')
+LOCAL_INDEX_PATH = os.getenv('LOCAL_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', index_name))
+MANIFEST_PATH = os.getenv('MANIFEST_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f"{index_name}-{VECTOR_BACKEND}.manifest.db"))
+CHECKPOINT_PATH = os.getenv('CHECKPOINT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f"{index_name}-{VECTOR_BACKEND}.checkpoint.json"))
+LEXICAL_INDEX_PATH = os.getenv('LEXICAL_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', f"{index_name}.lexical.db"))
+CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', '30'))
+DELETE_BATCH_SIZE = 1000  # Pinecone accepts at most 1000 ids per delete call
+
+if VECTOR_BACKEND == 'local':
+    # Local in-process index persisted next to the repo
+    index = LocalIndex(LOCAL_INDEX_PATH, dimension=EMBEDDING_DIMENSION, autosave=False)
+else:
+    # Initialize Pinecone
+    pc = Pinecone(api_key=PINECONE_API_KEY)
 
-# Ensure index has correct dimension (1536 for text-embedding-ada-002)
-if index_name in pc.list_indexes().names():
-    index_desc = pc.describe_index(index_name)
-    if index_desc.dimension != 1536:
-        logger.info(f"Index {index_name} has dimension {index_desc.dimension}. Deleting and recreating with 1536.")
-        pc.delete_index(index_name)
+    # Ensure the index dimension matches the embedding model ChatAgent queries with
+    if index_name in pc.list_indexes().names():
+        index_desc = pc.describe_index(index_name)
+        if index_desc.dimension != EMBEDDING_DIMENSION:
+            logger.info(f"Index {index_name} has dimension {index_desc.dimension}. Deleting and recreating with {EMBEDDING_DIMENSION}.")
+            pc.delete_index(index_name)
+            pc.create_index(
+                name=index_name,
+                dimension=EMBEDDING_DIMENSION,
+                metric='cosine',
+                spec=ServerlessSpec(cloud='aws', region=PINECONE_ENVIRONMENT)
+            )
+    else:
+        logger.info(f"Creating new index {index_name} with dimension {EMBEDDING_DIMENSION}.")
         pc.create_index(
             name=index_name,
-            dimension=1536,
+            dimension=EMBEDDING_DIMENSION,
             metric='cosine',
             spec=ServerlessSpec(cloud='aws', region=PINECONE_ENVIRONMENT)
         )
-else:
-    logger.info(f"Creating new index {index_name} with dimension 1536.")
-    pc.create_index(
-        name=index_name,
-        dimension=1536,
-        metric='cosine',
-        spec=ServerlessSpec(cloud='aws', region=PINECONE_ENVIRONMENT)
-    )
 
-# Connect to the index
-index = pc.Index(index_name)
+    # Connect to the index
+    index = pc.Index(index_name)
 
 # Initialize OpenAI client
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
+def embed_with_retry(texts):
+    """Embed a text or list of texts in one request, in input order.
+
+    Rate limits, connection errors and 5xx responses are retried with
+    exponential backoff and jitter; once EMBED_RETRIES is exhausted the error
+    is raised, so the run stops and checkpoints instead of dropping records.
+    Rejected input (400) is raised immediately.
+    """
+    delay = EMBED_BACKOFF_SECONDS
+    for attempt in range(EMBED_RETRIES + 1):
+        try:
+            response = openai_client.embeddings.create(input=texts, model=EMBEDDING_MODEL)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            if attempt == EMBED_RETRIES:
+                raise
+            wait = delay * (1 + random.random())
+            logger.warning(f"Embedding request failed ({e}); retry {attempt + 1}/{EMBED_RETRIES} in {wait:.1f}s")
+            time.sleep(wait)
+            delay *= 2
+
 def get_embedding(text):
-    """Generate embedding for the given text using OpenAI."""
+    """Generate embedding for the given text using OpenAI; None if the API rejects the text."""
     if not text.strip():
         logger.warning("Empty text provided for embedding. Skipping.")
         return None
     try:
-        response = openai_client.embeddings.create(
-            input=text,
-            model="text-embedding-ada-002"
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
+        return embed_with_retry(text)[0]
+    except BadRequestError as e:
+        logger.error(f"Skipping text rejected by the embeddings API: {e}")
         return None
 
-def load_to_pinecone():
-    """Load data from lutron_data.json into Pinecone."""
+def get_embeddings(texts):
+    """Generate embeddings for a batch of texts with a single OpenAI request."""
     try:
-        data = []
-        json_file = '/home/vincent/ixome/scrapy-selenium/lutron_scraper/lutron_data.json'
-        with open(json_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():  # Skip empty lines
-                    try:
-                        item = json.loads(line)
-                        data.append(item)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Skipping malformed JSON line: {line[:50]}... {e}")
-                        continue
-
-        if not data:
-            logger.warning("No valid data found in lutron_data.json.")
+        return embed_with_retry(texts)
+    except BadRequestError as e:
+        # One oversized or rejected text should not cost the whole batch
+        logger.error(f"Batch embedding rejected, retrying items individually: {e}")
+        return [get_embedding(text) for text in texts]
+
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def embed_batches(batches):
+    """Embed batches of (..., text) tuples concurrently, yielding (batch, embeddings) in input order.
+
+    At most EMBED_WORKERS requests are in flight at once.
+    """
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append((batch, pool.submit(get_embeddings, [text for *_, text in batch])))
+            if len(in_flight) >= EMBED_WORKERS:
+                done, future = in_flight.popleft()
+                yield done, future.result()
+        while in_flight:
+            done, future = in_flight.popleft()
+            yield done, future.result()
+
+class IndexManifest:
+    """SQLite record of which passage vectors are in the index and the last run that saw them."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS vectors (id TEXT PRIMARY KEY, url TEXT, run_id TEXT)")
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(vectors)")]
+        if 'parent_id' not in columns:
+            # Manifests written before chunking have no parent; their vectors are cleaned up as stale
+            self.db.execute("ALTER TABLE vectors ADD COLUMN parent_id TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS vectors_parent_id ON vectors(parent_id)")
+        self.db.commit()
+
+    def touch(self, parent_id, vector_ids, run_id):
+        """Mark a record's passages as still present in this run; return how many are indexed.
+
+        Only the given passage ids are marked, so passages the record no longer
+        splits into keep their old run_id and are deleted as stale.
+        """
+        placeholders = ', '.join('?' * len(vector_ids))
+        cursor = self.db.execute(
+            f"UPDATE vectors SET run_id = ? WHERE parent_id = ? AND id IN ({placeholders})",
+            (run_id, parent_id, *vector_ids)
+        )
+        return cursor.rowcount
+
+    def record(self, vectors, run_id):
+        """Remember vectors that were just upserted."""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO vectors (id, url, run_id, parent_id) VALUES (?, ?, ?, ?)",
+            [
+                (vector['id'], vector['metadata'].get('url', ''), run_id, vector['metadata'].get('parent_id'))
+                for vector in vectors
+            ]
+        )
+        self.db.commit()
+
+    def stale(self, run_id):
+        """Return ids that were indexed before but not seen in this run."""
+        return [row[0] for row in self.db.execute("SELECT id FROM vectors WHERE run_id != ?", (run_id,))]
+
+    def remove(self, ids):
+        self.db.executemany("DELETE FROM vectors WHERE id = ?", [(vector_id,) for vector_id in ids])
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+class Checkpoint:
+    """Byte offset and batch of the last confirmed upsert, written atomically as JSON."""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self.last_write = time.monotonic()
+
+    def load(self, json_files):
+        """Return the saved checkpoint if it belongs to one of json_files, or None."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if state.get('json_file') not in [os.path.abspath(json_file) for json_file in json_files]:
+            logger.warning(f"Checkpoint {self.path} belongs to {state.get('json_file')}; ignoring it.")
+            return None
+        return state
+
+    def save(self, position, run_id, batch, vectors_upserted):
+        json_file, offset = position
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'json_file': os.path.abspath(json_file),
+                'run_id': run_id,
+                'offset': offset,
+                'batch': batch,
+                'vectors_upserted': vectors_upserted,
+                'updated_at': time.strftime("%Y-%m-%d %H:%M:%S")
+            }, f)
+        os.replace(tmp_path, self.path)
+        self.last_write = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self.last_write >= CHECKPOINT_INTERVAL
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class IngestProgress:
+    """Track and periodically log ingestion throughput."""
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.bytes_read = 0
+        self.records_read = 0
+        self.records_skipped = 0
+        self.vectors_upserted = 0
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
             return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        logger.info(
+            f"Read {self.records_read} records ({self.records_skipped} unchanged), "
+            f"upserted {self.vectors_upserted} passages ({self.records_read / elapsed:.1f} records/s, "
+            f"{self.bytes_read / 1e6:.2f} MB read, {self.bytes_read / 1e6 / elapsed:.2f} MB/s)"
+        )
+
+def read_records(json_file, progress, offset=0):
+    """Yield (record, start_offset, end_offset) for each JSON line, starting at byte offset.
 
-        vectors = []
-        for item in data:
-            # Combine fields for embedding
-            text = f"{item.get('issue', '')} {item.get('solution', '')} {item.get('product', '')}".strip()
-            embedding = get_embedding(text)
-            if embedding is None:
+    Besides JSON lines this reads the scraper's batch exports: a JSON array
+    with one object per line, so the brackets and trailing commas are skipped.
+    """
+    with open(json_file, 'rb') as f:
+        f.seek(offset)
+        for raw in f:
+            start_offset = offset
+            offset += len(raw)
+            progress.bytes_read += len(raw)
+            line = raw.strip().rstrip(b',')
+            if not line or line in (b'[', b']'):  # Skip empty lines and array brackets
                 continue
-            vector_id = str(uuid.uuid4())
-            vectors.append({
-                'id': vector_id,
-                'values': embedding,
-                'metadata': {
-                    'issue': item.get('issue', ''),
-                    'solution': item.get('solution', ''),
-                    'product': item.get('product', ''),
-                    'category': item.get('category', ''),
-                    'url': item.get('url', '')
-                }
-            })
-
-        if vectors:
-            index.upsert(vectors=vectors)
-            logger.info(f"Successfully upserted {len(vectors)} vectors to Pinecone index {index_name}")
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping malformed JSON line: {line[:50]}... {e}")
+                continue
+            progress.records_read += 1
+            yield item, start_offset, offset
+
+def read_corpus(json_files, progress, position=None):
+    """Yield (record, start, end) across json_files in order; positions are (path, byte offset).
+
+    With a position, files before its path are skipped and reading resumes at its offset.
+    """
+    for json_file in json_files:
+        path = os.path.abspath(json_file)
+        if position is not None and path != position[0]:
+            continue
+        offset = position[1] if position is not None else 0
+        position = None
+        for item, start_offset, end_offset in read_records(json_file, progress, offset):
+            yield item, (path, start_offset), (path, end_offset)
+
+def make_vector_id(url, text):
+    """Derive a stable vector id from the record URL, the embedded content and the chunk settings.
+
+    Changing CHUNK_TOKENS or CHUNK_OVERLAP_TOKENS changes every id, so all
+    records are re-split and re-embedded and the old passages are deleted as stale.
+    """
+    return hashlib.sha256(f"{url}\x00{text}\x00{CHUNK_TOKENS}\x00{CHUNK_OVERLAP_TOKENS}".encode('utf-8')).hexdigest()
+
+def clean_record(item):
+    """Return (vector_id, metadata, text) for a record, or None if it has nothing to embed."""
+    if not isinstance(item, dict):
+        logger.warning(f"Skipping non-object record: {str(item)[:50]}")
+        return None
+    if 'text' in item and 'solution' not in item:
+        # Batch exports only carry the scraped text
+        item = dict(item, solution=item['text'])
+    metadata = {
+        field: str(item.get(field) or '').strip()
+        for field in ('issue', 'solution', 'product', 'category', 'url')
+    }
+    # Combine fields for embedding
+    text = f"{metadata['issue']} {metadata['solution']} {metadata['product']}".strip()
+    if not text:
+        logger.warning("Empty text provided for embedding. Skipping.")
+        return None
+    return make_vector_id(metadata['url'], text), metadata, text
+
+def split_record(parent_id, metadata):
+    """Split a record's solution into overlapping passages.
+
+    Returns (vector_id, metadata, text) per passage. Each passage keeps the
+    record's issue and product in its embedded text and points back to the
+    record through parent_id, so no single vector has to carry a whole guide.
+    """
+    passages = chunk_text(metadata['solution'], CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS) or ['']
+    split = []
+    for number, passage in enumerate(passages):
+        passage_metadata = dict(metadata, solution=passage, parent_id=parent_id, chunk=number, chunks=len(passages))
+        text = f"{metadata['issue']} {passage} {metadata['product']}".strip()
+        split.append((f"{parent_id}-{number}", passage_metadata, text))
+    return split
+
+def new_records(records, manifest, run_id, progress, lexical=None):
+    """Yield (position, vector_id, metadata, text) for passages not indexed yet.
+
+    Records whose passages are all indexed already are marked as seen in this
+    run and skipped. The position is the record's end for its last passage and
+    its start otherwise, so a checkpoint never skips half of a record.
+    Passages missing from the lexical index are added to it on the way; that
+    needs no embedding, so it also backfills records the vector index has.
+    """
+    for item, start, end in records:
+        record = clean_record(item)
+        if record is None:
+            continue
+        parent_id, metadata, _ = record
+        passages = split_record(parent_id, metadata)
+        if lexical is not None:
+            for vector_id, passage_metadata, text in passages:
+                if vector_id not in lexical:
+                    lexical.add(vector_id, f"{text} {metadata['category']}", passage_metadata)
+        if manifest.touch(parent_id, [vector_id for vector_id, *_ in passages], run_id) == len(passages):
+            progress.records_skipped += 1
+            continue
+        for number, passage in enumerate(passages):
+            position = end if number == len(passages) - 1 else start
+            yield (position,) + passage
+
+def delete_stale(manifest, run_id, lexical=None):
+    """Delete vectors for records that disappeared from the corpus since the last run."""
+    stale = manifest.stale(run_id)
+    for chunk in batched(stale, DELETE_BATCH_SIZE):
+        index.delete(ids=chunk)
+        manifest.remove(chunk)
+        if lexical is not None:
+            lexical.remove(chunk)
+    if stale:
+        logger.info(f"Deleted {len(stale)} stale vectors from index {index_name}")
+    return len(stale)
+
+def load_to_pinecone(json_files=None, resume=False):
+    """Stream records from the corpus files (LUTRON_DATA_GLOB by default) into the vector index.
+
+    Records flow read -> clean -> embed batch -> upsert batch, so peak memory is
+    bounded by the batch sizes rather than by the size of the corpus. Vector ids
+    are content hashes and the manifest remembers what is already indexed, so a
+    rerun only embeds new or changed records and deletes ones that disappeared.
+    All files are loaded in one run, so a record is only stale once it is gone
+    from every file. Every CHECKPOINT_INTERVAL seconds the file and byte offset
+    of the last confirmed upsert are saved; with resume=True a crashed run
+    continues from there.
+    """
+    json_files = json_files or sorted(glob.glob(LUTRON_DATA_GLOB))
+    progress = IngestProgress()
+    manifest = IndexManifest()
+    checkpoint = Checkpoint()
+    lexical = LexicalIndex(LEXICAL_INDEX_PATH)
+    run_id = uuid.uuid4().hex
+    position = None
+    batch_number = 0
+    last_upserted_position = None
+
+    state = checkpoint.load(json_files) if resume else None
+    if state:
+        run_id, position, batch_number = state['run_id'], (state['json_file'], state['offset']), state['batch']
+        progress.vectors_upserted = state.get('vectors_upserted', 0)
+        logger.info(f"Resuming run {run_id} from byte {position[1]} of {position[0]} after batch {batch_number}")
+    elif resume:
+        logger.info(f"No checkpoint found at {checkpoint.path}; starting from the beginning.")
+
+    def save_checkpoint(end_position):
+        if isinstance(index, LocalIndex):
+            index.save()
+        if lexical.dirty:
+            lexical.save()
+        checkpoint.save(end_position, run_id, batch_number, progress.vectors_upserted)
+
+    def flush(chunk):
+        nonlocal batch_number, last_upserted_position
+        vectors = [vector for _, vector in chunk]
+        index.upsert(vectors=vectors)
+        manifest.record(vectors, run_id)
+        progress.vectors_upserted += len(vectors)
+        batch_number += 1
+        last_upserted_position = chunk[-1][0]
+        if checkpoint.due():
+            save_checkpoint(last_upserted_position)
+
+    try:
+        records = new_records(read_corpus(json_files, progress, position), manifest, run_id, progress, lexical)
+        pending = []
+        for batch, embeddings in embed_batches(batched(records, EMBED_BATCH_SIZE)):
+            for (end_position, vector_id, metadata, _), embedding in zip(batch, embeddings):
+                if embedding is None:
+                    continue
+                pending.append((end_position, {'id': vector_id, 'values': embedding, 'metadata': metadata}))
+            # Upsert full chunks as soon as they are ready
+            while len(pending) >= UPSERT_BATCH_SIZE:
+                flush(pending[:UPSERT_BATCH_SIZE])
+                pending = pending[UPSERT_BATCH_SIZE:]
+            progress.report()
+        if pending:
+            flush(pending)
+
+        if not progress.records_read and position is None:
+            # Never treat an empty or missing corpus as "everything was deleted"
+            logger.warning(f"No valid data found in {json_files or LUTRON_DATA_GLOB}.")
+            return
+        deleted = delete_stale(manifest, run_id, lexical)
+        if isinstance(index, LocalIndex) and (progress.vectors_upserted or deleted):
+            index.save()
+        if lexical.dirty:
+            lexical.save()
+            logger.info(f"Saved lexical index with {len(lexical)} passages to {LEXICAL_INDEX_PATH}")
+        checkpoint.clear()
+        progress.report(force=True)
+        if progress.vectors_upserted:
+            logger.info(f"Successfully upserted {progress.vectors_upserted} vectors to Pinecone index {index_name}")
         else:
-            logger.warning("No vectors generated to upsert.")
+            logger.info("Index already up to date; no vectors upserted.")
 
     except Exception as e:
         logger.error(f"Error loading to Pinecone: {e}")
+        if last_upserted_position is not None:
+            save_checkpoint(last_upserted_position)
+            logger.error(f"Progress is checkpointed in {checkpoint.path}; rerun with --resume to continue.")
+    finally:
+        manifest.close()
 
 if __name__ == "__main__":
-    load_to_pinecone()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load the Lutron troubleshooting corpus into the vector index.")
+    parser.add_argument('json_files', nargs='*', help=f"corpus files to index (default: {LUTRON_DATA_GLOB})")
+    parser.add_argument('--resume', action='store_true', help="continue from the last checkpoint of a failed run")
+    args = parser.parse_args()
+    load_to_pinecone(args.json_files, resume=args.resume)
\ No newline at end of file